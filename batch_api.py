@@ -0,0 +1,222 @@
+"""
+OpenAI Batch API module.
+Submits chat completion requests as an offline batch job and collects the responses,
+and runs whole invoices through extraction and classification batch jobs.
+"""
+import asyncio
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from openai import AsyncOpenAI
+from clients import get_client
+from config import Config
+from invoice_extractor import InvoiceExtractor
+from tax_matcher import TaxMatcher
+
+
+class BatchRunner:
+    """Runs groups of chat completion requests through the OpenAI Batch API."""
+
+    ENDPOINT = "/v1/chat/completions"
+    TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        """
+        Initialize the batch runner.
+
+        Args:
+            client: OpenAI client to submit batches with (defaults to the shared client)
+        """
+        # Batch jobs aren't paced by the rate limiter, so keep the SDK's own retries for them
+        self.client = (client or get_client()).with_options(max_retries=2)
+
+    def _write_input_file(self, requests: Dict[str, Dict[str, Any]], label: str) -> Path:
+        """Write one JSONL line per request, keyed by its custom_id."""
+        input_path = Path(Config.OUTPUT_DIR) / f"batch_{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for custom_id, body in requests.items():
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": self.ENDPOINT,
+                    "body": body
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        return input_path
+
+    async def _download_lines(self, file_id: str) -> list[Dict[str, Any]]:
+        """Download a batch output/error file and parse its JSONL lines."""
+        content = await self.client.files.content(file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    async def run(self, requests: Dict[str, Dict[str, Any]], label: str = "requests") -> Dict[str, Dict[str, Any]]:
+        """
+        Submit requests as a batch job and wait for it to finish.
+
+        Args:
+            requests: Chat completion request bodies keyed by custom_id
+            label: Short name used in the input file name and progress output
+
+        Returns:
+            Chat completion response bodies keyed by custom_id. Requests that
+            failed inside the batch are left out, so callers must handle misses.
+        """
+        if not requests:
+            return {}
+
+        input_path = self._write_input_file(requests, label)
+        with open(input_path, 'rb') as f:
+            input_file = await self.client.files.create(file=f, purpose="batch")
+
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.ENDPOINT,
+            completion_window="24h"
+        )
+        print(f"  Submitted {label} batch {batch.id} ({len(requests)} requests)")
+
+        while batch.status not in self.TERMINAL_STATUSES:
+            await asyncio.sleep(Config.BATCH_POLL_INTERVAL)
+            batch = await self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                print(f"  Batch {batch.id}: {batch.status} ({counts.completed}/{counts.total} done)")
+
+        if batch.status != "completed":
+            print(f"  Warning: batch {batch.id} ended with status '{batch.status}'")
+
+        responses: Dict[str, Dict[str, Any]] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in await self._download_lines(file_id):
+                response = line.get('response') or {}
+                if response.get('status_code') == 200:
+                    responses[line['custom_id']] = response['body']
+                else:
+                    error = line.get('error') or response.get('body')
+                    print(f"  Warning: batch request {line.get('custom_id')} failed: {error}")
+
+        return responses
+
+
+async def run_invoice_batches(pdf_paths: List[str], extractor: InvoiceExtractor, tax_matcher: TaxMatcher,
+                              check_tax_exempt: bool = True) -> Dict[str, tuple[Dict[str, Any], bool,
+                                                                                 List[tuple[str, float]], int, int]]:
+    """
+    Extract and classify invoices in two batch jobs instead of live calls.
+
+    The first job extracts every PDF not in the extraction cache. The second
+    checks the notes for tax exemption (when the extraction didn't already
+    flag it) and sends one classification request per invoice for the line
+    items the extraction didn't classify and the matcher can't resolve
+    locally. Batch jobs cost half as much and have their own rate-limit pool,
+    but may take up to 24 hours.
+
+    Args:
+        pdf_paths: Invoice PDFs to process
+        extractor: Extractor building and parsing the extraction requests
+        tax_matcher: Matcher building and parsing the tax-exempt and classification requests
+        check_tax_exempt: Whether to check the notes for tax exemption
+
+    Returns:
+        (extracted_data, is_tax_exempt, classifications, prompt_tokens, completion_tokens)
+        keyed by PDF path
+    """
+    runner = BatchRunner(extractor.client)
+    usage = {path: [0, 0] for path in pdf_paths}
+
+    def add_usage(path: str, body: Dict[str, Any]):
+        body_usage = body.get('usage') or {}
+        usage[path][0] += body_usage.get('prompt_tokens', 0)
+        usage[path][1] += body_usage.get('completion_tokens', 0)
+
+    # Stage 1: extraction. Paths can share a file name, so requests are keyed by
+    # position; files extracted on a previous run come from the cache
+    extracted: Dict[str, Dict[str, Any]] = {}
+    digests: Dict[str, str] = {}
+    extraction_requests = {}
+    for index, path in enumerate(pdf_paths):
+        try:
+            digests[path], cached, content = await extractor.load_pdf(path)
+        except OSError as e:
+            print(f"  Warning: Could not read {path}: {e}")
+            extracted[path] = extractor.failed_extraction_result('ERROR', f'Extraction error: {str(e)}')
+            continue
+        if cached is not None:
+            extracted[path] = cached
+            continue
+        request = extractor.build_extraction_request(content)
+        if request:
+            extraction_requests[f"{index}:extract"] = request
+    extraction_responses = await runner.run(extraction_requests, "extraction")
+
+    for index, path in enumerate(pdf_paths):
+        if path in extracted:
+            continue
+        body = extraction_responses.get(f"{index}:extract")
+        if body is None:
+            extracted[path] = extractor.failed_extraction_result('ERROR', 'Extraction error: no batch response')
+            continue
+        add_usage(path, body)
+        try:
+            extracted[path] = extractor.parse_extraction_response(body['choices'][0]['message']['content'])
+            extractor.cache_extraction(digests[path], extracted[path])
+        except (KeyError, IndexError, ValueError) as e:
+            extracted[path] = extractor.failed_extraction_result('ERROR', f'Extraction error: {str(e)}')
+
+    # Stage 2: tax-exempt checks and one classification request per invoice. Each
+    # distinct description is classified once (dict.fromkeys drops repeated rows)
+    followup_requests = {}
+    pending_descriptions: Dict[str, List[str]] = {}
+    for index, path in enumerate(pdf_paths):
+        data = extracted[path]
+        notes = data.get('notes') or ''
+        if check_tax_exempt and not extractor.classifies_line_items and notes.strip():
+            followup_requests[f"{index}:tax_exempt"] = tax_matcher.build_tax_exempt_request(notes)
+        pending = list(dict.fromkeys(
+            item.get('description', '') for item in data.get('line_items', [])
+            if tax_matcher.known_match(item.get('tax_category')) is None
+            and tax_matcher.get_cached_match(item.get('description', '')) is None))
+        if pending:
+            pending_descriptions[path] = pending
+            followup_requests[f"{index}:classify"] = tax_matcher.build_classification_request(pending)
+    followup_responses = await runner.run(followup_requests, "classification")
+
+    results = {}
+    for index, path in enumerate(pdf_paths):
+        data = extracted[path]
+
+        is_tax_exempt = bool(data.get('is_tax_exempt', False))
+        body = followup_responses.get(f"{index}:tax_exempt")
+        if body is not None:
+            add_usage(path, body)
+            try:
+                is_tax_exempt = tax_matcher.parse_tax_exempt_response(body['choices'][0]['message']['content'])
+            except (KeyError, IndexError, TypeError, AttributeError) as e:
+                print(f"  Warning: Could not check tax-exempt status for {path}: {e}")
+                is_tax_exempt = False  # Default to taxable, like the live check
+
+        new_matches: Dict[str, tuple[str, float]] = {}
+        body = followup_responses.get(f"{index}:classify")
+        if body is not None:
+            add_usage(path, body)
+            try:
+                pending = pending_descriptions[path]
+                new_matches = dict(zip(pending, tax_matcher.parse_classification_response(
+                    body['choices'][0]['message']['content'], pending)))
+            except (KeyError, IndexError, ValueError) as e:
+                print(f"  Warning: Could not parse classifications for {path}: {e}")
+
+        classifications = []
+        for item in data.get('line_items', []):
+            description = item.get('description', '')
+            match = (tax_matcher.known_match(item.get('tax_category'))
+                     or new_matches.get(description) or tax_matcher.get_cached_match(description))
+            classifications.append(match or tax_matcher.default_match())
+
+        results[path] = (data, is_tax_exempt, classifications, *usage[path])
+    return results
@@ -0,0 +1,67 @@
+"""
+Disk cache module.
+Content-addressable JSON cache so repeated runs can skip API calls for unchanged inputs.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+from config import Config
+
+
+def sha256_hex(data: bytes) -> str:
+    """Return the SHA-256 hex digest of some bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskCache:
+    """Stores JSON-serializable values in a directory, one <sha256(key)>.json file per key."""
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            namespace: Sub-directory of Config.CACHE_DIR used for this cache
+            ttl: Seconds an entry stays valid after it was written (None keeps entries forever)
+        """
+        self.directory = Path(Config.CACHE_DIR) / namespace
+        self.ttl = ttl
+        self.enabled = Config.CACHE_ENABLED
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{sha256_hex(key.encode('utf-8'))}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            # Expired entries are misses; the next put overwrites them
+            if self.ttl is not None and time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, value: Any):
+        """Store a value for key."""
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            # Atomic rename so concurrent readers never see a half-written entry
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write cache entry {path.name}: {e}")
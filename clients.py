@@ -0,0 +1,72 @@
+"""
+Shared OpenAI client module.
+Provides a single AsyncOpenAI client (and connection pool) for the whole process.
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAioHttpClient
+from config import Config
+
+
+_shared_client: Optional[AsyncOpenAI] = None
+
+
+def get_client() -> AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client, creating it on first use.
+
+    Every component shares this client so requests reuse pooled keep-alive
+    connections instead of each one opening its own pool (and TLS sessions).
+    Config.HTTP_TRANSPORT picks the transport: "aiohttp" holds its throughput at
+    high concurrency where httpx's own pool degrades, while "httpx" uses HTTP/2
+    to multiplex concurrent requests over the same connection.
+    The client is created lazily so importing modules doesn't require an API key.
+    """
+    global _shared_client
+
+    if _shared_client is None:
+        limits = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30.0)
+        timeout = httpx.Timeout(120.0, connect=10.0)  # Vision extractions can take a while
+        if Config.HTTP_TRANSPORT == "aiohttp":
+            http_client = DefaultAioHttpClient(limits=limits, timeout=timeout)
+        else:
+            http_client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+        # Retries are handled by rate_limiter.create_chat_completion so they respect the rate limits
+        _shared_client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY, http_client=http_client, max_retries=0)
+
+    return _shared_client
+
+
+async def close_client():
+    """Close the shared client and its connection pool, if one was created."""
+    global _shared_client
+
+    if _shared_client is not None:
+        await _shared_client.close()
+        _shared_client = None
+
+
+async def warm_up(client: AsyncOpenAI):
+    """
+    Open the connection (TCP + TLS handshake) before the first real request.
+
+    Lists models, which is free, so the first extraction or classification
+    call doesn't pay the connection setup on top of its own latency.
+    """
+    try:
+        await client.models.list()
+    except openai.OpenAIError as e:
+        print(f"Warning: Could not warm up the OpenAI connection: {e}")
+
+
+@asynccontextmanager
+async def client_session() -> AsyncIterator[AsyncOpenAI]:
+    """Provide the shared client, warmed up, and close its connections when the block exits."""
+    try:
+        client = get_client()
+        await warm_up(client)
+        yield client
+    finally:
+        await close_client()
@@ -15,15 +15,55 @@ class Config:
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_MODEL = "gpt-4o"  # Using GPT-4 with vision for invoice processing
+    CLASSIFICATION_MODEL = "gpt-4o-mini"  # Using mini for cost efficiency on simple classification
+    CLASSIFICATION_BACKEND = "chat"  # "chat" (CLASSIFICATION_MODEL) or "embedding" (nearest category by embedding)
+    EMBEDDING_MODEL = "text-embedding-3-small"  # Used by the embedding classification backend
+    HTTP_TRANSPORT = "aiohttp"  # "aiohttp" (scales better under high concurrency) or "httpx" (HTTP/2)
 
     # File paths
     INVOICES_DIR = "Invoices"
     TAX_RATES_FILE = "tax_rate_by_category.csv"
     OUTPUT_DIR = "output"
+    CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+    CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, "checkpoints")  # One results_<timestamp>.jsonl per run, streamed as invoices complete
+
+    # Cache settings
+    CACHE_ENABLED = True  # Reuse extraction/classification results for unchanged inputs
+    CLASSIFICATION_MEMORY_SIZE = 10_000  # Classifications kept in memory per run
+    CLASSIFICATION_CACHE_TTL = 30 * 24 * 3600  # Seconds before a cached classification is asked again
 
     # Processing settings
     MAX_TOKENS = 4000
     TEMPERATURE = 0.0  # Zero temperature for maximum consistency and deterministic outputs
+    PDF_MAX_PAGES = 1  # Leading pages rendered/read per invoice (first page for most invoices)
+    PDF_RENDER_DPI = 150  # Resolution of page images sent to the vision model
+    IMAGE_JPEG_QUALITY = 85  # JPEG quality of page images sent to the vision model
+    PDF_RENDER_PROCESSES = os.cpu_count() or 1  # Worker processes rasterizing PDFs ahead of extraction
+    VISION_DETAIL = "low"  # "low" (~85 image tokens) or "high"; low-detail misses are retried with high
+    CLASSIFICATION_CHUNK_SIZE = 25  # Line items per classification request
+    CLASSIFICATION_CONCURRENCY = 10  # Classification requests in flight per invoice
+    FUSED_CLASSIFICATION = True  # Classify line items and detect tax exemption in the extraction call
+    MAX_CONCURRENT_INVOICES = 10  # Invoices processed concurrently (bounded by API rate limits)
+
+    # Rate limits applied per model before each request. These defaults are
+    # replaced by the account's real limits when PROBE_RATE_LIMITS is on.
+    MODEL_RATE_LIMITS = {  # (requests/min, tokens/min) per model, OpenAI's usage tier 1 limits
+        "gpt-4o": (500, 30_000),
+        "gpt-4o-mini": (500, 200_000),
+        "text-embedding-3-small": (3_000, 1_000_000),
+    }
+    MAX_REQUESTS_PER_MINUTE = 500  # For models not listed in MODEL_RATE_LIMITS
+    MAX_TOKENS_PER_MINUTE = 30_000  # For models not listed in MODEL_RATE_LIMITS
+    MAX_IN_FLIGHT_REQUESTS = 50  # Requests per model sent but not yet answered
+    PROBE_RATE_LIMITS = True  # Send a 1-token request per model at startup to read the limits
+    API_MAX_ATTEMPTS = 6  # Attempts per API call for rate-limit, server, timeout and connection errors
+
+    # Batch API settings (used with `python main.py --batch`)
+    USE_BATCH_API = False  # Send requests through the Batch API by default (same as main.py --batch)
+    BATCH_POLL_INTERVAL = 30  # Seconds between batch status checks
+
+    # Debug settings (used by test_detailed.py)
+    DEBUG_JSON = False  # Log the raw extracted data at debug level (same as test_detailed.py --verbose)
 
     @classmethod
     def validate(cls):
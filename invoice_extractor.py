@@ -2,66 +2,458 @@
 Invoice extraction module.
 Handles extraction of invoice data from various formats using OpenAI's vision capabilities.
 """
+import asyncio
 import base64
 import json
+import re
+import threading
+from concurrent.futures import Executor
 from pathlib import Path
-from typing import Dict, List, Any
-from openai import OpenAI
+from typing import Callable, Dict, List, Any, Optional, Union
+from cache import DiskCache, sha256_hex
+from clients import get_client
 from config import Config
-import PyPDF2
-from pdf2image import convert_from_path
+from openai import AsyncOpenAI
+from rate_limiter import create_chat_completion
+from tax_matcher import CLASSIFICATION_RULES
+import pypdfium2 as pdfium
 from io import BytesIO
 
 
-class InvoiceExtractor:
-    """Extracts structured data from invoice files using GPT-4 Vision."""
+# Bump whenever EXTRACTION_PROMPT or the request shape changes so cached extractions are invalidated
+PROMPT_VERSION = "2"
 
-    def __init__(self):
-        """Initialize the invoice extractor."""
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
-        self.last_prompt_tokens = 0
-        self.last_completion_tokens = 0
+EXTRACTION_PROMPT = """You are an expert invoice data extraction system. Extract structured data from this invoice.
+
+Return a JSON object with this EXACT structure:
+{
+    "invoice_number": "invoice number or ID",
+    "vendor_name": "vendor or supplier name",
+    "invoice_date": "date in YYYY-MM-DD format if possible",
+    "line_items": [
+        {
+            "description": "product or service description",
+            "quantity": numeric_quantity,
+            "unit_price": numeric_price_per_unit,
+            "total": numeric_line_total
+        }
+    ],
+    "notes": "any special notes, terms, or observations"
+}
 
-    def _pdf_to_base64_images(self, pdf_path: str) -> List[str]:
-        """Convert PDF pages to base64 encoded images."""
+Important:
+- Extract ALL line items from the invoice
+- For quantities and prices, use numbers only (no currency symbols or commas)
+- If a field is not found, use null or empty string
+- Be precise with line item descriptions
+- Calculate totals if not explicitly stated (quantity * unit_price)
+- Return ONLY valid JSON, no additional text"""
+
+# System prompt used when the extraction call also classifies line items and checks tax exemption
+FUSED_SYSTEM_PROMPT_TEMPLATE = """You extract invoices and classify them for tax purposes in a single pass.
+
+For each line item, set "tax_category" to the MOST SPECIFIC matching category from this list:
+{categories}
+
+{rules}
+
+Set "is_tax_exempt" to true only if the invoice notes or terms indicate that no tax should be applied (tax-exempt, tax-free, no tax required, tax waived or not applicable). Otherwise set it to false."""
+
+
+_PDFIUM_LOCK = threading.Lock()
+
+
+def read_pdf(pdf: Union[str, bytes], max_pages: int, dpi: int, jpeg_quality: int) -> tuple[str, List[str]]:
+    """
+    Read the text layer and render base64 encoded JPEG images of the leading PDF pages.
+
+    Both come from one PDFium document, so the file is opened and parsed once.
+    Module-level (and configured through arguments) so it can run in a worker process.
+
+    Args:
+        pdf: Path to the PDF file, or its bytes
+        max_pages: Number of leading pages to read and render
+        dpi: Render resolution
+        jpeg_quality: JPEG quality of the encoded pages
+
+    Returns:
+        Tuple of (text, base64 images with one per rendered page); empty on failure
+    """
+    # PDFium is not thread-safe; worker processes each get their own lock
+    with _PDFIUM_LOCK:
         try:
-            # Convert PDF to images (first page only for most invoices)
-            images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=200)
+            pdf = pdfium.PdfDocument(pdf)
+        except (pdfium.PdfiumError, OSError) as e:
+            print(f"Error opening PDF: {e}")
+            return "", []
+
+        try:
+            texts = []
             base64_images = []
 
-            for image in images:
+            # Only read the pages that are sent to the model (first page for most invoices)
+            for index in range(min(max_pages, len(pdf))):
+                page = pdf[index]
+                texts.append(page.get_textpage().get_text_range())
+
+                # PDF pages are measured in points, 72 to the inch
+                image = page.render(scale=dpi / 72).to_pil()
+                # JPEG has no alpha channel
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
                 buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                base64_images.append(img_base64)
+                # JPEG is roughly half the size of PNG for scanned pages, shrinking the upload
+                image.save(buffered, format="JPEG", quality=jpeg_quality, optimize=True)
+                base64_images.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
 
-            return base64_images
+            return "\n".join(texts).strip(), base64_images
         except Exception as e:
-            print(f"Error converting PDF to images: {e}")
-            return []
+            print(f"Error converting PDF: {e}")
+            return "", []
+        finally:
+            pdf.close()
 
-    def _try_extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Attempt to extract text directly from PDF."""
-        try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
-        except Exception as e:
-            print(f"Could not extract text from PDF: {e}")
-            return ""
 
-    def extract_invoice_data(self, file_path: str) -> Dict[str, Any]:
+def content_cache_key(digest: str, max_pages: int, dpi: int, jpeg_quality: int) -> str:
+    """Key rendered PDF content by file digest and the render settings."""
+    return f"{digest}:{max_pages}:{dpi}:{jpeg_quality}"
+
+
+def load_pdf_for_extraction(pdf_path: str, extraction_cache: DiskCache, extraction_key_suffix: str,
+                            content_cache: DiskCache, max_pages: int, dpi: int, jpeg_quality: int
+                            ) -> tuple[str, Optional[Dict[str, Any]], Optional[tuple[str, List[str]]]]:
+    """
+    Do all the disk work an extraction needs for one PDF, reading the file once.
+
+    Hashes the file, then looks up a cached extraction; only on a miss is the
+    text and page images taken from the content cache or rendered (and cached).
+    Module-level (and configured through arguments) so it can run in a worker
+    process, keeping every file read and hash off the event loop.
+
+    Args:
+        pdf_path: Path to the PDF file
+        extraction_cache: Cache of finished extractions
+        extraction_key_suffix: Extraction cache key after the file digest
+        content_cache: Cache of rendered PDF content
+        max_pages: Number of leading pages to read and render
+        dpi: Render resolution
+        jpeg_quality: JPEG quality of the encoded pages
+
+    Returns:
+        Tuple of (digest, cached extraction or None, (text, base64 images) or
+        None when the extraction was cached)
+    """
+    data = Path(pdf_path).read_bytes()
+    digest = sha256_hex(data)
+
+    cached = extraction_cache.get(digest + extraction_key_suffix)
+    if cached is not None:
+        return digest, cached, None
+
+    # An unchanged file rendered with the same settings needs no PDF work at all,
+    # e.g. when only the prompt changed and the extraction cache missed
+    content_key = content_cache_key(digest, max_pages, dpi, jpeg_quality)
+    cached_content = content_cache.get(content_key)
+    if cached_content is not None:
+        return digest, None, (cached_content[0], cached_content[1])
+
+    content = read_pdf(data, max_pages, dpi, jpeg_quality)
+    if content[1]:
+        content_cache.put(content_key, list(content))
+    return digest, None, content
+
+
+class LineItemStreamParser:
+    """Decodes the objects of a streamed JSON reply's "line_items" array as soon as each one is complete."""
+
+    LINE_ITEMS_START = re.compile(r'"line_items"\s*:\s*\[')
+
+    def __init__(self):
+        """Initialize the parser before the first chunk of the reply."""
+        self._buffer = ""
+        self._position: Optional[int] = None  # Where the next item starts, once the array has opened
+        self._finished = False
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Add a chunk of the reply.
+
+        Args:
+            chunk: Next piece of the streamed message content
+
+        Returns:
+            Line items completed by this chunk, in order
+        """
+        self._buffer += chunk
+        items = []
+        if self._finished:
+            return items
+
+        if self._position is None:
+            match = self.LINE_ITEMS_START.search(self._buffer)
+            if match is None:
+                return items
+            self._position = match.end()
+
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n,':
+                self._position += 1
+            if self._position >= len(self._buffer):
+                break
+            if self._buffer[self._position] == ']':
+                self._finished = True
+                break
+            try:
+                item, self._position = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                break  # The item isn't complete yet; wait for more chunks
+            items.append(item)
+
+        return items
+
+
+class InvoiceExtractor:
+    """Extracts structured data from invoice files using GPT-4 Vision."""
+
+    def __init__(self, categories: Optional[List[str]] = None, client: Optional[AsyncOpenAI] = None):
+        """
+        Initialize the invoice extractor.
+
+        Args:
+            categories: Tax categories to classify line items into during extraction.
+                When given, each line item gets a 'tax_category' and the result gets
+                an 'is_tax_exempt' flag, so no separate classification calls are needed.
+            client: OpenAI client to send requests with (defaults to the shared client)
+        """
+        self.client = client or get_client()
+        self.categories = categories
+        self._fused_system_prompt = None
+        self._fused_response_format = None
+        if categories:
+            self._fused_system_prompt = FUSED_SYSTEM_PROMPT_TEMPLATE.format(
+                categories="\n".join(f"- {cat}" for cat in categories), rules=CLASSIFICATION_RULES)
+            self._fused_response_format = self._build_fused_response_format(categories)
+        self.cache = DiskCache("extractions")
+        # Extractions are keyed by file digest, model, prompt version and category set
+        self._extraction_key_suffix = f":{Config.OPENAI_MODEL}:{PROMPT_VERSION}"
+        if self._fused_system_prompt is not None:
+            self._extraction_key_suffix += ":" + sha256_hex(self._fused_system_prompt.encode('utf-8'))
+        self.content_cache = DiskCache("pdf_content")
+        self._prefetched_content: Dict[str, asyncio.Future] = {}
+
+    def _load_pdf_args(self, file_path: str) -> tuple:
+        """Arguments for load_pdf_for_extraction, all picklable for a worker process."""
+        return (load_pdf_for_extraction, file_path, self.cache, self._extraction_key_suffix, self.content_cache,
+                Config.PDF_MAX_PAGES, Config.PDF_RENDER_DPI, Config.IMAGE_JPEG_QUALITY)
+
+    def prefetch_pdf_content(self, file_path: str, executor: Executor):
+        """
+        Start the disk work for a PDF's extraction in an executor ahead of time.
+
+        Reading, hashing, cache lookups and CPU-bound rasterization all happen
+        in the executor, so the caller does no file I/O; extract_invoice_data
+        picks the result up when it reaches this file.
+
+        Args:
+            file_path: Path to the invoice PDF
+            executor: Executor to run in (usually a ProcessPoolExecutor)
+        """
+        loop = asyncio.get_running_loop()
+        self._prefetched_content[file_path] = loop.run_in_executor(executor, *self._load_pdf_args(file_path))
+
+    def clear_prefetched_pdf_content(self):
+        """Drop PDF content prefetched for files that were never extracted."""
+        self._prefetched_content.clear()
+
+    async def load_pdf(self, file_path: str
+                       ) -> tuple[str, Optional[Dict[str, Any]], Optional[tuple[str, List[str]]]]:
+        """
+        Return (digest, cached extraction, (text, images)) for a PDF, as load_pdf_for_extraction does.
+
+        Uses the prefetched result if there is one, otherwise does the work on a thread.
+        """
+        prefetched = self._prefetched_content.pop(file_path, None)
+        if prefetched is not None:
+            return await prefetched
+        return await asyncio.to_thread(*self._load_pdf_args(file_path))
+
+    @property
+    def classifies_line_items(self) -> bool:
+        """Whether extraction results carry tax categories and the tax-exempt flag."""
+        return self._fused_system_prompt is not None
+
+    @staticmethod
+    def _build_fused_response_format(categories: List[str]) -> Dict[str, Any]:
+        """Strict JSON schema for extraction plus classification."""
+        nullable_string = {"type": ["string", "null"]}
+        nullable_number = {"type": ["number", "null"]}
+        line_item = {
+            "type": "object",
+            "properties": {
+                "description": {"type": "string"},
+                "quantity": nullable_number,
+                "unit_price": nullable_number,
+                "total": nullable_number,
+                "tax_category": {"type": "string", "enum": categories}
+            },
+            "required": ["description", "quantity", "unit_price", "total", "tax_category"],
+            "additionalProperties": False
+        }
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "invoice_extraction",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "invoice_number": nullable_string,
+                        "vendor_name": nullable_string,
+                        "invoice_date": nullable_string,
+                        "line_items": {"type": "array", "items": line_item},
+                        "notes": nullable_string,
+                        "is_tax_exempt": {"type": "boolean"}
+                    },
+                    "required": ["invoice_number", "vendor_name", "invoice_date",
+                                 "line_items", "notes", "is_tax_exempt"],
+                    "additionalProperties": False
+                }
+            }
+        }
+
+    def _build_request(self, pdf_text: str, base64_images: List[str], detail: str) -> Dict[str, Any]:
+        """Build the extraction request body from already loaded PDF content."""
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": EXTRACTION_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_images[0]}",
+                            "detail": detail
+                        }
+                    }
+                ]
+            }
+        ]
+
+        if pdf_text:
+            messages[0]["content"].insert(1, {
+                "type": "text",
+                "text": f"Extracted text from PDF:\n{pdf_text[:2000]}"
+            })
+
+        response_format = {"type": "json_object"}
+        if self.classifies_line_items:
+            messages.insert(0, {"role": "system", "content": self._fused_system_prompt})
+            response_format = self._fused_response_format
+
+        return {
+            "model": Config.OPENAI_MODEL,
+            "messages": messages,
+            "temperature": Config.TEMPERATURE,
+            "max_tokens": Config.MAX_TOKENS,
+            "response_format": response_format
+        }
+
+    def build_extraction_request(self, content: tuple[str, List[str]]) -> Optional[Dict[str, Any]]:
+        """
+        Build the chat completion request body for extracting an invoice.
+
+        The same body is used for live calls and for Batch API submissions.
+
+        Args:
+            content: The PDF's (text, base64 images), as returned by load_pdf
+
+        Returns:
+            Keyword arguments for chat.completions.create, or None if the file
+            could not be converted into something the model can read
+        """
+        pdf_text, base64_images = content
+        if not base64_images:
+            return None
+
+        return self._build_request(pdf_text, base64_images, Config.VISION_DETAIL)
+
+    @staticmethod
+    def _looks_incomplete(data: Dict[str, Any]) -> bool:
+        """Whether an extraction is missing the basics, suggesting the image was too coarse."""
+        invoice_number = str(data.get('invoice_number') or '').strip()
+        return not invoice_number or not data.get('line_items')
+
+    def cache_extraction(self, digest: str, data: Dict[str, Any]):
+        """Remember a successful extraction for future runs."""
+        self.cache.put(digest + self._extraction_key_suffix, data)
+
+    @staticmethod
+    def parse_extraction_response(content: str) -> Dict[str, Any]:
+        """Parse the model's JSON reply into the extracted invoice dictionary."""
+        return json.loads(content)
+
+    @staticmethod
+    def failed_extraction_result(marker: str, notes: str) -> Dict[str, Any]:
+        """Placeholder result used when an invoice could not be extracted."""
+        return {
+            'invoice_number': marker,
+            'vendor_name': marker,
+            'invoice_date': '',
+            'line_items': [],
+            'notes': notes,
+            'is_tax_exempt': False
+        }
+
+    async def _complete(self, request: Dict[str, Any],
+                        on_line_item: Optional[Callable[[Dict[str, Any]], None]]) -> tuple[str, int, int]:
+        """
+        Send an extraction request and return (content, prompt_tokens, completion_tokens).
+
+        With on_line_item, the reply is streamed and each line item is reported
+        as soon as it has been generated, while the rest is still arriving.
+        """
+        if on_line_item is None:
+            response = await create_chat_completion(self.client, request)
+            if hasattr(response, 'usage') and response.usage:
+                return (response.choices[0].message.content,
+                        response.usage.prompt_tokens, response.usage.completion_tokens)
+            return response.choices[0].message.content, 0, 0
+
+        stream = await create_chat_completion(
+            self.client, {**request, "stream": True, "stream_options": {"include_usage": True}})
+        parser = LineItemStreamParser()
+        parts = []
+        prompt_tokens = 0
+        completion_tokens = 0
+        async for chunk in stream:
+            # Usage arrives on a final chunk without choices
+            if chunk.usage:
+                prompt_tokens = chunk.usage.prompt_tokens
+                completion_tokens = chunk.usage.completion_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            parts.append(chunk.choices[0].delta.content)
+            for item in parser.feed(chunk.choices[0].delta.content):
+                on_line_item(item)
+        return "".join(parts), prompt_tokens, completion_tokens
+
+    async def extract_invoice_data(self, file_path: str,
+                                   on_line_item: Optional[Callable[[Dict[str, Any]], None]] = None
+                                   ) -> tuple[Dict[str, Any], int, int]:
         """
         Extract structured invoice data from a file.
 
         Args:
             file_path: Path to the invoice file
+            on_line_item: Called with each line item as soon as it is available, so
+                callers can start work on it (e.g. classification) while the rest
+                of the reply streams in. Items can be reported again if the
+                extraction is retried with high detail; the returned data is final.
 
         Returns:
-            Dictionary containing extracted invoice data with structure:
+            Tuple of (data, prompt_tokens, completion_tokens). Token counts are
+            0 for cached extractions. The data has the structure:
             {
                 'invoice_number': str,
                 'vendor_name': str,
@@ -71,104 +463,57 @@ class InvoiceExtractor:
                         'description': str,
                         'quantity': float,
                         'unit_price': float,
-                        'total': float
+                        'total': float,
+                        'tax_category': str  # only when classifying during extraction
                     }
                 ],
-                'notes': str
+                'notes': str,
+                'is_tax_exempt': bool  # only when classifying during extraction
             }
         """
-        file_path_obj = Path(file_path)
-        file_extension = file_path_obj.suffix.lower()
+        prompt_tokens = 0
+        completion_tokens = 0
 
-        # First try to extract text from PDF
-        pdf_text = ""
-        if file_extension == '.pdf':
-            pdf_text = self._try_extract_text_from_pdf(file_path)
+        try:
+            if Path(file_path).suffix.lower() != '.pdf':
+                return self.failed_extraction_result('UNKNOWN', 'Failed to extract data'), 0, 0
 
-        extraction_prompt = """You are an expert invoice data extraction system. Extract structured data from this invoice.
+            # One read of the file (prefetched or on a thread); its digest keys every cache entry
+            digest, cached, content = await self.load_pdf(file_path)
 
-Return a JSON object with this EXACT structure:
-{
-    "invoice_number": "invoice number or ID",
-    "vendor_name": "vendor or supplier name",
-    "invoice_date": "date in YYYY-MM-DD format if possible",
-    "line_items": [
-        {
-            "description": "product or service description",
-            "quantity": numeric_quantity,
-            "unit_price": numeric_price_per_unit,
-            "total": numeric_line_total
-        }
-    ],
-    "notes": "any special notes, terms, or observations"
-}
+            # Identical file bytes were already extracted: no API call needed
+            if cached is not None:
+                if on_line_item is not None:
+                    for item in cached.get('line_items', []):
+                        on_line_item(item)
+                return cached, 0, 0
 
-Important:
-- Extract ALL line items from the invoice
-- For quantities and prices, use numbers only (no currency symbols or commas)
-- If a field is not found, use null or empty string
-- Be precise with line item descriptions
-- Calculate totals if not explicitly stated (quantity * unit_price)
-- Return ONLY valid JSON, no additional text"""
+            pdf_text, base64_images = content
+            if base64_images:
+                detail = Config.VISION_DETAIL
+                content, call_prompt_tokens, call_completion_tokens = await self._complete(
+                    self._build_request(pdf_text, base64_images, detail), on_line_item)
+                prompt_tokens += call_prompt_tokens
+                completion_tokens += call_completion_tokens
+                result = self.parse_extraction_response(content)
 
-        try:
-            if file_extension == '.pdf':
-                # Try vision approach for PDFs
-                base64_images = self._pdf_to_base64_images(file_path)
-
-                if base64_images:
-                    messages = [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": extraction_prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/png;base64,{base64_images[0]}"
-                                    }
-                                }
-                            ]
-                        }
-                    ]
-
-                    if pdf_text:
-                        messages[0]["content"].insert(1, {
-                            "type": "text",
-                            "text": f"Extracted text from PDF:\n{pdf_text[:2000]}"
-                        })
-
-                    response = self.client.chat.completions.create(
-                        model=Config.OPENAI_MODEL,
-                        messages=messages,
-                        temperature=Config.TEMPERATURE,
-                        max_tokens=Config.MAX_TOKENS,
-                        response_format={"type": "json_object"}
-                    )
-
-                    # Capture token usage
-                    if hasattr(response, 'usage') and response.usage:
-                        self.last_prompt_tokens = response.usage.prompt_tokens
-                        self.last_completion_tokens = response.usage.completion_tokens
-
-                    result = json.loads(response.choices[0].message.content)
-                    return result
-
-            # Fallback for other formats or if PDF processing fails
-            return {
-                'invoice_number': 'UNKNOWN',
-                'vendor_name': 'UNKNOWN',
-                'invoice_date': '',
-                'line_items': [],
-                'notes': 'Failed to extract data'
-            }
+                # Low detail is far cheaper but can miss fine print; pay for high detail only when needed
+                if detail != "high" and self._looks_incomplete(result):
+                    print(f"  Incomplete {detail}-detail extraction for {Path(file_path).name}, retrying with high detail")
+                    content, call_prompt_tokens, call_completion_tokens = await self._complete(
+                        self._build_request(pdf_text, base64_images, "high"), on_line_item)
+                    prompt_tokens += call_prompt_tokens
+                    completion_tokens += call_completion_tokens
+                    result = self.parse_extraction_response(content)
+
+                await asyncio.to_thread(self.cache_extraction, digest, result)
+                return result, prompt_tokens, completion_tokens
+
+            # Fallback if PDF processing fails
+            return self.failed_extraction_result('UNKNOWN', 'Failed to extract data'), 0, 0
 
         except Exception as e:
             print(f"Error extracting invoice data from {file_path}: {e}")
-            return {
-                'invoice_number': 'ERROR',
-                'vendor_name': 'ERROR',
-                'invoice_date': '',
-                'line_items': [],
-                'notes': f'Extraction error: {str(e)}'
-            }
+            # Tokens already spent on a reply that couldn't be used are still reported
+            return (self.failed_extraction_result('ERROR', f'Extraction error: {str(e)}'),
+                    prompt_tokens, completion_tokens)
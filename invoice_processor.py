@@ -2,24 +2,53 @@
 Main invoice processor orchestrating the entire workflow.
 Coordinates extraction, tax matching, and result persistence.
 """
-import json
+import asyncio
 import csv
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional
+import orjson
+from openai import AsyncOpenAI
+from batch_api import run_invoice_batches
+from clients import get_client
 from invoice_extractor import InvoiceExtractor
 from tax_matcher import TaxMatcher
 from config import Config
+from rate_limiter import create_chat_completion
+
+
+# Column order of the flattened (one row per line item) CSV output
+CSV_FIELDS = [
+    'InvoiceID', 'FileName', 'VendorName', 'InvoiceDate',
+    'AIPromptTokens', 'AICompletionTokens', 'ProcessingDateTime',
+    'InvoicePreTaxTotal', 'InvoiceTaxTotal', 'InvoicePostTaxTotal',
+    'LineItemDescription', 'Quantity', 'UnitPrice', 'LineTotal',
+    'TaxCategory', 'TaxRate', 'TaxAmount', 'LineTotalWithTax',
+    'SpecialNotes'
+]
+
+# Invoice IDs of the placeholder results saved when an invoice could not be extracted
+FAILED_INVOICE_IDS = ('ERROR', 'UNKNOWN')
 
 
 class InvoiceProcessor:
     """Main service for processing invoices end-to-end."""
 
-    def __init__(self):
-        """Initialize the invoice processor with required components."""
-        self.extractor = InvoiceExtractor()
-        self.tax_matcher = TaxMatcher()
-        self.results: List[Dict[str, Any]] = []
+    def __init__(self, resume: bool = False, client: Optional[AsyncOpenAI] = None):
+        """
+        Initialize the invoice processor with required components.
+
+        Args:
+            resume: Continue the most recent run's checkpoint and skip the invoices
+                already in it, instead of starting a new checkpoint
+            client: OpenAI client shared by every component (defaults to the shared client)
+        """
+        self.client = client or get_client()
+        self.tax_matcher = TaxMatcher(client=self.client)
+        self.extractor = InvoiceExtractor(
+            categories=self.tax_matcher.categories if Config.FUSED_CLASSIFICATION else None,
+            client=self.client)
 
         # Token tracking
         self.total_prompt_tokens = 0
@@ -28,7 +57,70 @@ class InvoiceProcessor:
         # Create output directory if it doesn't exist
         Path(Config.OUTPUT_DIR).mkdir(exist_ok=True)
 
-    def _check_tax_exempt(self, notes: str) -> tuple[bool, int, int]:
+        # Results are streamed to a JSONL checkpoint as they complete instead of held in
+        # memory; only the byte offset of each invoice's line is kept. Every run gets its
+        # own checkpoint, so starting over never deletes an earlier run's results.
+        checkpoint_dir = Path(Config.CHECKPOINT_DIR)
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self._result_offsets: Dict[str, int] = {}
+        previous = self.latest_checkpoint() if resume else None
+        if previous is not None:
+            self.checkpoint_path = previous
+            self._load_checkpoint()
+            print(f"Resuming {previous.name}: {len(self._result_offsets)} invoices already processed")
+        else:
+            if resume:
+                print("No checkpoint to resume, starting a new run")
+            self.checkpoint_path = checkpoint_dir / f"results_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl"
+            self.checkpoint_path.write_bytes(b"")
+
+    @staticmethod
+    def latest_checkpoint() -> Optional[Path]:
+        """Return the most recent run's checkpoint, if there is one."""
+        # Timestamped names sort chronologically
+        checkpoints = sorted(Path(Config.CHECKPOINT_DIR).glob("results_*.jsonl"))
+        return checkpoints[-1] if checkpoints else None
+
+    def _load_checkpoint(self):
+        """Index the results of a previous run, dropping a line cut off by a crash."""
+        valid_end = 0
+        with open(self.checkpoint_path, 'rb') as f:
+            for line in f:
+                try:
+                    result = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    break
+                # Failed extractions (often from whatever interrupted the run) are left
+                # out, so they get processed again; a later line replaces an earlier one
+                if result['InvoiceID'] in FAILED_INVOICE_IDS:
+                    self._result_offsets.pop(result['FileName'], None)
+                else:
+                    self._result_offsets[result['FileName']] = valid_end
+                valid_end += len(line)
+
+        # A partial last line would corrupt the next result appended after it
+        with open(self.checkpoint_path, 'r+b') as f:
+            f.truncate(valid_end)
+
+    def _save_result(self, result: Dict[str, Any]):
+        """Append a result to the checkpoint so it survives a crash."""
+        with open(self.checkpoint_path, 'ab') as f:
+            offset = f.tell()
+            f.write(orjson.dumps(result) + b"\n")
+        self._result_offsets[result['FileName']] = offset
+
+    def is_processed(self, file_path: str) -> bool:
+        """Whether an invoice already has a result (from this run or a resumed one)."""
+        return Path(file_path).name in self._result_offsets
+
+    def iter_results(self) -> Iterator[Dict[str, Any]]:
+        """Yield the processed invoice results in file name order, reading them from the checkpoint."""
+        with open(self.checkpoint_path, 'rb') as f:
+            for name in sorted(self._result_offsets):
+                f.seek(self._result_offsets[name])
+                yield orjson.loads(f.readline())
+
+    async def _check_tax_exempt(self, notes: str) -> tuple[bool, int, int]:
         """
         Check if invoice notes indicate tax-exempt status using LLM.
 
@@ -41,33 +133,8 @@ class InvoiceProcessor:
         if not notes or notes.strip() == '':
             return False, 0, 0
 
-        from openai import OpenAI
-        client = OpenAI(api_key=Config.OPENAI_API_KEY)
-
-        prompt = f"""You are a tax compliance expert. Analyze the following invoice notes and determine if this invoice should be TAX-EXEMPT (no taxes should be applied).
-
-Invoice Notes: "{notes}"
-
-Look for any indication that:
-- Tax should not be applied
-- Items are tax-exempt
-- Invoice is tax-free
-- No tax is required
-- Tax is waived or not applicable
-
-Respond with ONLY "YES" if the invoice is tax-exempt, or "NO" if taxes should be applied normally.
-Do not include any explanation."""
-
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a tax compliance expert. Answer only YES or NO."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0,
-                max_tokens=10
-            )
+            response = await create_chat_completion(self.client, self.tax_matcher.build_tax_exempt_request(notes))
 
             # Capture token usage
             prompt_tokens = 0
@@ -76,60 +143,43 @@ Do not include any explanation."""
                 prompt_tokens = response.usage.prompt_tokens
                 completion_tokens = response.usage.completion_tokens
 
-            answer = response.choices[0].message.content.strip().upper()
-            return answer == "YES", prompt_tokens, completion_tokens
+            is_tax_exempt = self.tax_matcher.parse_tax_exempt_response(response.choices[0].message.content)
+            return is_tax_exempt, prompt_tokens, completion_tokens
 
         except Exception as e:
             print(f"  Warning: Could not check tax-exempt status: {e}")
             return False, 0, 0  # Default to taxable if AI call fails
 
-    def process_invoice(self, file_path: str) -> Dict[str, Any]:
+    def _compile_result(self, file_path: str, extracted_data: Dict[str, Any], is_tax_exempt: bool,
+                        classifications: List[tuple[str, float]],
+                        prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
         """
-        Process a single invoice file.
+        Combine extracted data and tax classifications into the final invoice result.
 
         Args:
             file_path: Path to the invoice file
+            extracted_data: Output of the invoice extractor
+            is_tax_exempt: Whether the invoice notes mark it as tax-exempt
+            classifications: (tax_category, tax_rate) for each extracted line item
+            prompt_tokens: Prompt tokens spent on this invoice
+            completion_tokens: Completion tokens spent on this invoice
 
         Returns:
             Dictionary containing processed invoice data with tax calculations
         """
-        print(f"\nProcessing: {Path(file_path).name}")
-
-        # Extract invoice data (1 API call to GPT-4 Vision)
-        extracted_data = self.extractor.extract_invoice_data(file_path)
-
-        # Track tokens from extraction
-        invoice_prompt_tokens = self.extractor.last_prompt_tokens
-        invoice_completion_tokens = self.extractor.last_completion_tokens
-
-        # Check if invoice is tax-exempt based on notes (1 API call to GPT-4 Mini if notes exist)
-        notes = extracted_data.get('notes', '')
-        is_tax_exempt, tax_exempt_prompt_tokens, tax_exempt_completion_tokens = self._check_tax_exempt(notes)
-
-        # Add tax-exempt check tokens to invoice total
-        invoice_prompt_tokens += tax_exempt_prompt_tokens
-        invoice_completion_tokens += tax_exempt_completion_tokens
-
         if is_tax_exempt:
-            print("  ⚠️  TAX-EXEMPT INVOICE DETECTED (from notes)")
+            print(f"  ⚠️  TAX-EXEMPT INVOICE DETECTED (from notes): {Path(file_path).name}")
 
-        # Process each line item and match tax categories
+        # Process each line item with its matched tax category
         processed_line_items = []
         total_pre_tax = 0.0
         total_tax = 0.0
 
-        for item in extracted_data.get('line_items', []):
+        for item, (tax_category, tax_rate) in zip(extracted_data.get('line_items', []), classifications):
             description = item.get('description', '')
-            quantity = float(item.get('quantity', 0))
-            unit_price = float(item.get('unit_price', 0))
-            line_total = float(item.get('total', quantity * unit_price))
-
-            # Match tax category (even if tax-exempt, we still classify for reporting)
-            tax_category, tax_rate = self.tax_matcher.match_category(description)
-
-            # Aggregate tokens from tax classification
-            invoice_prompt_tokens += self.tax_matcher.last_prompt_tokens
-            invoice_completion_tokens += self.tax_matcher.last_completion_tokens
+            quantity = float(item.get('quantity') or 0)
+            unit_price = float(item.get('unit_price') or 0)
+            line_total = float(item['total'] if item.get('total') is not None else quantity * unit_price)
 
             # Override tax rate if invoice is tax-exempt
             if is_tax_exempt:
@@ -155,8 +205,8 @@ Do not include any explanation."""
             total_tax += tax_amount
 
         # Update global token tracking
-        self.total_prompt_tokens += invoice_prompt_tokens
-        self.total_completion_tokens += invoice_completion_tokens
+        self.total_prompt_tokens += prompt_tokens
+        self.total_completion_tokens += completion_tokens
 
         # Compile final result
         result = {
@@ -164,8 +214,8 @@ Do not include any explanation."""
             'FileName': Path(file_path).name,
             'VendorName': extracted_data.get('vendor_name', 'UNKNOWN'),
             'InvoiceDate': extracted_data.get('invoice_date', ''),
-            'AIPromptTokens': invoice_prompt_tokens,
-            'AICompletionTokens': invoice_completion_tokens,
+            'AIPromptTokens': prompt_tokens,
+            'AICompletionTokens': completion_tokens,
             'ProcessingDateTime': datetime.now().isoformat(),
             'InvoicePreTaxTotal': round(total_pre_tax, 2),
             'InvoiceTaxTotal': round(total_tax, 2),
@@ -174,80 +224,181 @@ Do not include any explanation."""
             'SpecialNotes': extracted_data.get('notes', '')
         }
 
-        print(f"  Invoice ID: {result['InvoiceID']}")
-        print(f"  Line Items: {len(processed_line_items)}")
-        print(f"  Pre-Tax Total: ${result['InvoicePreTaxTotal']:.2f}")
-        print(f"  Tax Total: ${result['InvoiceTaxTotal']:.2f}")
-        print(f"  Post-Tax Total: ${result['InvoicePostTaxTotal']:.2f}")
+        # Print the summary in one call so concurrent invoices don't interleave lines
+        print(f"\nCompleted: {result['FileName']}\n"
+              f"  Invoice ID: {result['InvoiceID']}\n"
+              f"  Line Items: {len(processed_line_items)}\n"
+              f"  Pre-Tax Total: ${result['InvoicePreTaxTotal']:.2f}\n"
+              f"  Tax Total: ${result['InvoiceTaxTotal']:.2f}\n"
+              f"  Post-Tax Total: ${result['InvoicePostTaxTotal']:.2f}")
 
-        self.results.append(result)
         return result
 
-    def process_all_invoices(self, invoices_dir: str = None) -> List[Dict[str, Any]]:
+    async def process_invoice(self, file_path: str) -> Dict[str, Any]:
         """
-        Process all invoices in the specified directory.
+        Process a single invoice file.
+
+        Args:
+            file_path: Path to the invoice file
+
+        Returns:
+            Dictionary containing processed invoice data with tax calculations
+        """
+        print(f"\nProcessing: {Path(file_path).name}")
+
+        # Extract invoice data (1 API call to GPT-4 Vision)
+        extracted_data, invoice_prompt_tokens, invoice_completion_tokens = \
+            await self.extractor.extract_invoice_data(file_path)
+
+        if self.extractor.classifies_line_items:
+            # The extraction call already flagged tax exemption and classified the line items
+            is_tax_exempt = bool(extracted_data.get('is_tax_exempt', False))
+        else:
+            # Check if invoice is tax-exempt based on notes (1 API call to GPT-4 Mini if notes exist)
+            notes = extracted_data.get('notes', '')
+            is_tax_exempt, tax_exempt_prompt_tokens, tax_exempt_completion_tokens = await self._check_tax_exempt(notes)
+
+            # Add tax-exempt check tokens to invoice total
+            invoice_prompt_tokens += tax_exempt_prompt_tokens
+            invoice_completion_tokens += tax_exempt_completion_tokens
+
+        # Match tax categories for the line items the extraction didn't classify, in one call
+        # (even if tax-exempt, we still classify for reporting)
+        line_items = extracted_data.get('line_items', [])
+        classifications = [self.tax_matcher.known_match(item.get('tax_category')) for item in line_items]
+        unmatched = [i for i, match in enumerate(classifications) if match is None]
+        if unmatched:
+            matches, classification_prompt_tokens, classification_completion_tokens = \
+                await self.tax_matcher.match_categories([line_items[i].get('description', '') for i in unmatched])
+            for i, match in zip(unmatched, matches):
+                classifications[i] = match
+
+            # Aggregate tokens from tax classification
+            invoice_prompt_tokens += classification_prompt_tokens
+            invoice_completion_tokens += classification_completion_tokens
+
+        result = self._compile_result(file_path, extracted_data, is_tax_exempt, classifications,
+                                      invoice_prompt_tokens, invoice_completion_tokens)
+
+        self._save_result(result)
+        return result
+
+    def find_invoice_files(self, invoices_dir: str = None) -> List[Path]:
+        """
+        List the invoice files in a directory.
 
         Args:
             invoices_dir: Directory containing invoice files
 
         Returns:
-            List of processed invoice results
+            Paths of the PDF invoices found
         """
         if invoices_dir is None:
             invoices_dir = Config.INVOICES_DIR
 
-        invoice_path = Path(invoices_dir)
-        invoice_files = list(invoice_path.glob('*.pdf'))
+        return sorted(Path(invoices_dir).glob('*.pdf'))
 
-        print(f"\nFound {len(invoice_files)} invoice files to process")
+    async def process_invoices_batch(self, invoice_files: List[Path]):
+        """
+        Process invoices through the OpenAI Batch API instead of live calls.
+
+        Runs in two batch jobs: the first extracts every invoice, the second
+        checks notes for tax exemption and classifies every line item. Batch
+        jobs cost half as much as live calls but may take up to 24 hours.
+
+        Invoices that already have a result (when resuming) are skipped.
+
+        Args:
+            invoice_files: Invoice files to process
+        """
+        invoice_files = [f for f in invoice_files if not self.is_processed(str(f))]
+
+        print(f"\nFound {len(invoice_files)} invoice files to process (batch mode)")
         print("=" * 60)
 
-        for invoice_file in invoice_files:
-            try:
-                self.process_invoice(str(invoice_file))
-            except Exception as e:
-                print(f"Error processing {invoice_file.name}: {e}")
-                continue
+        results = await run_invoice_batches([str(f) for f in invoice_files], self.extractor, self.tax_matcher)
+        for path, (data, is_tax_exempt, classifications, prompt_tokens, completion_tokens) in results.items():
+            self._save_result(self._compile_result(path, data, is_tax_exempt, classifications,
+                                                   prompt_tokens, completion_tokens))
 
         print("\n" + "=" * 60)
-        print(f"Processing complete! Processed {len(self.results)} invoices")
-
-        return self.results
+        print(f"Processing complete! Processed {len(self._result_offsets)} invoices")
 
-    def save_results_json(self, output_path: str = None):
+    async def process_all_invoices(self, invoices_dir: str = None):
         """
-        Save processing results as JSON file.
+        Process all invoices in the specified directory.
+
+        Invoices are processed concurrently (up to Config.MAX_CONCURRENT_INVOICES
+        at a time) since each one is dominated by OpenAI API latency. Invoices
+        that already have a result (when resuming) are skipped.
 
         Args:
-            output_path: Path for output JSON file
+            invoices_dir: Directory containing invoice files
         """
-        if output_path is None:
-            output_path = f"{Config.OUTPUT_DIR}/invoice_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        invoice_files = [f for f in self.find_invoice_files(invoices_dir) if not self.is_processed(str(f))]
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, indent=2, ensure_ascii=False)
+        print(f"\nFound {len(invoice_files)} invoice files to process")
+        print("=" * 60)
 
-        print(f"\nResults saved to: {output_path}")
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_INVOICES)
 
-    def save_results_csv(self, output_path: str = None):
+        with ProcessPoolExecutor(max_workers=Config.PDF_RENDER_PROCESSES) as render_pool:
+            # Read, hash and rasterize PDFs ahead of their API calls across all cores (cache
+            # checks included, so nothing here touches the disk). Only a window of invoices
+            # is prefetched, topped up as invoices finish, so the rendered page images of a
+            # large directory are never all held in memory at once.
+            pdf_files = iter([f for f in invoice_files if f.suffix.lower() == '.pdf'])
+
+            def prefetch_next():
+                invoice_file = next(pdf_files, None)
+                if invoice_file is not None:
+                    self.extractor.prefetch_pdf_content(str(invoice_file), render_pool)
+
+            for _ in range(Config.MAX_CONCURRENT_INVOICES * 2):
+                prefetch_next()
+
+            async def process_bounded(invoice_file: Path):
+                async with semaphore:
+                    try:
+                        await self.process_invoice(str(invoice_file))
+                    except Exception as e:
+                        print(f"Error processing {invoice_file.name}: {e}")
+                    finally:
+                        prefetch_next()
+
+            tasks = [process_bounded(f) for f in invoice_files]
+            await asyncio.gather(*tasks)
+            self.extractor.clear_prefetched_pdf_content()
+
+        print("\n" + "=" * 60)
+        print(f"Processing complete! Processed {len(self._result_offsets)} invoices")
+
+    def save_results_json(self, output_path: str = None):
         """
-        Save processing results as CSV file (flattened format).
+        Save processing results as JSON file.
 
         Args:
-            output_path: Path for output CSV file
+            output_path: Path for output JSON file
         """
         if output_path is None:
-            output_path = f"{Config.OUTPUT_DIR}/invoice_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            output_path = f"{Config.OUTPUT_DIR}/invoice_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
-        if not self.results:
-            print("No results to save")
-            return
+        # Converted from the checkpoint one invoice at a time; orjson encodes straight
+        # to UTF-8 bytes and is several times faster than json
+        with open(output_path, 'wb') as f:
+            f.write(b"[")
+            for index, result in enumerate(self.iter_results()):
+                f.write(b",\n" if index else b"\n")
+                f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+            f.write(b"\n]\n")
 
-        # Flatten data for CSV
-        flattened_rows = []
-        for invoice in self.results:
+        print(f"\nResults saved to: {output_path}")
+
+    def _iter_csv_rows(self) -> Iterator[Dict[str, Any]]:
+        """Yield one flattened CSV row per line item, without building the whole table."""
+        for invoice in self.iter_results():
             for item in invoice['InvoiceLineItems']:
-                row = {
+                yield {
                     'InvoiceID': invoice['InvoiceID'],
                     'FileName': invoice['FileName'],
                     'VendorName': invoice['VendorName'],
@@ -268,16 +419,34 @@ Do not include any explanation."""
                     'LineTotalWithTax': item['line_total_with_tax'],
                     'SpecialNotes': invoice['SpecialNotes']
                 }
-                flattened_rows.append(row)
 
-        # Write CSV
-        if flattened_rows:
-            with open(output_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=flattened_rows[0].keys())
-                writer.writeheader()
-                writer.writerows(flattened_rows)
+    def save_results_csv(self, output_path: str = None):
+        """
+        Save processing results as CSV file (flattened format).
+
+        Args:
+            output_path: Path for output CSV file
+        """
+        if output_path is None:
+            output_path = f"{Config.OUTPUT_DIR}/invoice_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+        if not self._result_offsets:
+            print("No results to save")
+            return
+
+        rows = self._iter_csv_rows()
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+
+        # Write CSV, streaming rows straight from the checkpoint
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerow(first_row)
+            writer.writerows(rows)
 
-            print(f"CSV results saved to: {output_path}")
+        print(f"CSV results saved to: {output_path}")
 
     def save_summary_report(self, output_path: str = None):
         """
@@ -289,11 +458,26 @@ Do not include any explanation."""
         if output_path is None:
             output_path = f"{Config.OUTPUT_DIR}/processing_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
 
-        total_invoices = len(self.results)
-        total_line_items = sum(len(inv['InvoiceLineItems']) for inv in self.results)
-        total_pre_tax = sum(inv['InvoicePreTaxTotal'] for inv in self.results)
-        total_tax = sum(inv['InvoiceTaxTotal'] for inv in self.results)
-        total_post_tax = sum(inv['InvoicePostTaxTotal'] for inv in self.results)
+        # One pass over the checkpoint for both the totals and the per-invoice details
+        total_invoices = 0
+        total_line_items = 0
+        total_pre_tax = 0.0
+        total_tax = 0.0
+        total_post_tax = 0.0
+        details = []
+        for invoice in self.iter_results():
+            total_invoices += 1
+            total_line_items += len(invoice['InvoiceLineItems'])
+            total_pre_tax += invoice['InvoicePreTaxTotal']
+            total_tax += invoice['InvoiceTaxTotal']
+            total_post_tax += invoice['InvoicePostTaxTotal']
+            details.append(f"""
+Invoice: {invoice['InvoiceID']} | File: {invoice['FileName']}
+  Vendor: {invoice['VendorName']}
+  Date: {invoice['InvoiceDate']}
+  Line Items: {len(invoice['InvoiceLineItems'])}
+  Pre-Tax: ${invoice['InvoicePreTaxTotal']:,.2f} | Tax: ${invoice['InvoiceTaxTotal']:,.2f} | Post-Tax: ${invoice['InvoicePostTaxTotal']:,.2f}
+""")
 
         report = f"""
 INVOICE PROCESSING SUMMARY REPORT
@@ -317,14 +501,7 @@ INVOICE DETAILS
 ---------------
 """
 
-        for invoice in self.results:
-            report += f"""
-Invoice: {invoice['InvoiceID']} | File: {invoice['FileName']}
-  Vendor: {invoice['VendorName']}
-  Date: {invoice['InvoiceDate']}
-  Line Items: {len(invoice['InvoiceLineItems'])}
-  Pre-Tax: ${invoice['InvoicePreTaxTotal']:,.2f} | Tax: ${invoice['InvoiceTaxTotal']:,.2f} | Post-Tax: ${invoice['InvoicePostTaxTotal']:,.2f}
-"""
+        report += "".join(details)
 
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(report)
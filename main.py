@@ -2,14 +2,69 @@
 Main entry point for the RetailCo Invoice Processing Service.
 Run this script to process invoices from the Invoices directory.
 """
+import argparse
+import asyncio
 import sys
 from pathlib import Path
+from clients import client_session
 from config import Config
 from invoice_processor import InvoiceProcessor
+from rate_limiter import probe_limits
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="RetailCo Invoice Processing Service")
+    parser.add_argument("invoice_file", nargs="?",
+                        help="Process a single invoice instead of the whole invoices directory")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit requests through the OpenAI Batch API (50%% cheaper, up to 24h turnaround)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the most recent run, skipping invoices it already processed successfully")
+    args = parser.parse_args()
+    args.batch = args.batch or Config.USE_BATCH_API
+    return args
+
+
+async def run_processing(args) -> InvoiceProcessor:
+    """
+    Run the requested processing mode inside one event loop.
+
+    The shared OpenAI client is closed on the way out so its pooled
+    connections are shut down cleanly.
+    """
+    async with client_session() as client:
+        # Initialize processor
+        processor = InvoiceProcessor(resume=args.resume, client=client)
+
+        # Live calls are paced against the account's real limits (batch jobs have their own pool)
+        if Config.PROBE_RATE_LIMITS and not args.batch:
+            print("\nChecking OpenAI rate limits...")
+            for model in (Config.OPENAI_MODEL, Config.CLASSIFICATION_MODEL):
+                await probe_limits(processor.client, model)
+
+        if args.invoice_file:
+            print(f"\nProcessing single invoice: {args.invoice_file}")
+            if args.batch:
+                await processor.process_invoices_batch([Path(args.invoice_file)])
+            else:
+                await processor.process_invoice(args.invoice_file)
+        elif args.batch:
+            # Submit all invoices in the directory as batch jobs
+            print(f"\nBatch processing all invoices from: {Config.INVOICES_DIR}")
+            await processor.process_invoices_batch(processor.find_invoice_files())
+        else:
+            # Process all invoices in the directory
+            print(f"\nProcessing all invoices from: {Config.INVOICES_DIR}")
+            await processor.process_all_invoices()
+
+    return processor
 
 
 def main():
     """Main function to orchestrate invoice processing."""
+    args = parse_args()
+
     print("=" * 70)
     print("RetailCo Invoice Processing Service")
     print("Automated Tax Category Classification and Calculation")
@@ -20,22 +75,12 @@ def main():
         Config.validate()
         print("\nConfiguration validated successfully")
 
-        # Initialize processor
-        processor = InvoiceProcessor()
-
         # Check if specific invoice file is provided as argument
-        if len(sys.argv) > 1:
-            invoice_file = sys.argv[1]
-            if not Path(invoice_file).exists():
-                print(f"Error: File not found: {invoice_file}")
-                sys.exit(1)
-
-            print(f"\nProcessing single invoice: {invoice_file}")
-            processor.process_invoice(invoice_file)
-        else:
-            # Process all invoices in the directory
-            print(f"\nProcessing all invoices from: {Config.INVOICES_DIR}")
-            processor.process_all_invoices()
+        if args.invoice_file and not Path(args.invoice_file).exists():
+            print(f"Error: File not found: {args.invoice_file}")
+            sys.exit(1)
+
+        processor = asyncio.run(run_processing(args))
 
         # Save results in multiple formats
         print("\nSaving results...")
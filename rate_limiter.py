@@ -0,0 +1,240 @@
+"""
+Rate limiting module.
+Keeps request and token throughput under the account's per-model OpenAI limits.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from config import Config
+
+
+# Rough token cost of one image input, used only for budgeting before the call
+IMAGE_TOKEN_ESTIMATE = 1000
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+# Transient failures (429, 5xx, timeouts, dropped connections) worth retrying;
+# anything else is surfaced to the caller immediately
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError,
+                    openai.APITimeoutError, openai.APIConnectionError)
+
+
+class TokenBucket:
+    """
+    Leaky-bucket budget for one model's requests-per-minute and tokens-per-minute limits.
+
+    Capacity refills continuously; callers wait until both budgets can cover
+    their request instead of firing it and getting a 429 back. A semaphore
+    also caps how many of the model's requests are in flight at once, so a
+    burst can't open more connections than the budget could ever use.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_in_flight: int):
+        """
+        Initialize the bucket at full capacity.
+
+        Args:
+            requests_per_minute: Request budget per minute
+            tokens_per_minute: Token budget per minute
+            max_in_flight: Requests allowed to be awaiting a response at once
+        """
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._available_requests = min(self.requests_per_minute,
+                                       self._available_requests + elapsed * self.requests_per_minute / 60)
+        self._available_tokens = min(self.tokens_per_minute,
+                                     self._available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, estimated_tokens: int):
+        """
+        Wait until the budget covers one request of roughly estimated_tokens tokens, then spend it.
+
+        Args:
+            estimated_tokens: Prompt plus max completion tokens expected for the request
+        """
+        async with self._condition:
+            while True:
+                self._refill()
+                # A single request larger than the whole budget would otherwise wait forever
+                tokens_needed = min(estimated_tokens, self.tokens_per_minute)
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._available_requests >= 1 and self._available_tokens >= tokens_needed:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens_needed
+                    return
+                else:
+                    wait = max((1 - self._available_requests) * 60 / self.requests_per_minute,
+                               (tokens_needed - self._available_tokens) * 60 / self.tokens_per_minute)
+
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=max(wait, 0.01))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def pause(self, seconds: float):
+        """Stop handing out budget for a while, e.g. after the API answered 429."""
+        async with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def update_limits(self, requests_per_minute: int, tokens_per_minute: int):
+        """Replace the limits, e.g. with the account's real limits reported by the API."""
+        async with self._condition:
+            self._refill()
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self._available_requests = min(self._available_requests, requests_per_minute)
+            self._available_tokens = min(self._available_tokens, tokens_per_minute)
+            self._condition.notify_all()
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(model: str) -> TokenBucket:
+    """Return the shared bucket for a model, creating it with the model's configured limits."""
+    if model not in _buckets:
+        requests_per_minute, tokens_per_minute = Config.MODEL_RATE_LIMITS.get(
+            model, (Config.MAX_REQUESTS_PER_MINUTE, Config.MAX_TOKENS_PER_MINUTE))
+        _buckets[model] = TokenBucket(requests_per_minute, tokens_per_minute, Config.MAX_IN_FLIGHT_REQUESTS)
+    return _buckets[model]
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Estimate the tokens a chat completion or embedding request will consume (~4 characters per token)."""
+    estimate = request.get('max_tokens') or 0
+    inputs = request.get('input')
+    for text in [inputs] if isinstance(inputs, str) else inputs or []:
+        estimate += len(text) // 4 + 1
+    for message in request.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str):
+            estimate += len(content) // 4
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                estimate += len(part.get('text', '')) // 4
+            elif part.get('type') == 'image_url':
+                low_detail = part.get('image_url', {}).get('detail') == 'low'
+                estimate += LOW_DETAIL_IMAGE_TOKENS if low_detail else IMAGE_TOKEN_ESTIMATE
+    return estimate
+
+
+def _retry_after_seconds(error: openai.RateLimitError) -> Optional[float]:
+    """Read the server's requested back-off from a 429 response, if present."""
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+@retry(
+    stop=stop_after_attempt(Config.API_MAX_ATTEMPTS),
+    wait=wait_random_exponential(multiplier=1, min=1, max=60),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
+async def create_chat_completion(client: AsyncOpenAI, request: Dict[str, Any]):
+    """
+    Send a chat completion request once the model's rate-limit budget and in-flight cap allow it.
+
+    A streamed reply holds its in-flight slot only until the stream starts.
+    Rate-limit, server, timeout and connection errors are retried with
+    randomized exponential backoff (each attempt waits for budget again);
+    callers only see the error once Config.API_MAX_ATTEMPTS attempts have failed.
+
+    Args:
+        client: OpenAI client to send the request with
+        request: Keyword arguments for chat.completions.create
+
+    Returns:
+        The chat completion response
+    """
+    bucket = get_bucket(request['model'])
+    async with bucket.in_flight:
+        # Budget is only spent once a slot is free, so queued requests don't drain it
+        await bucket.acquire(estimate_tokens(request))
+
+        try:
+            return await client.chat.completions.create(**request)
+        except openai.RateLimitError as e:
+            # Hold back every caller of this model, not just this one
+            await bucket.pause(_retry_after_seconds(e) or 1.0)
+            raise
+
+
+@retry(
+    stop=stop_after_attempt(Config.API_MAX_ATTEMPTS),
+    wait=wait_random_exponential(multiplier=1, min=1, max=60),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
+async def create_embedding(client: AsyncOpenAI, request: Dict[str, Any]):
+    """
+    Send an embeddings request once the model's rate-limit budget and in-flight cap allow it.
+
+    Retried like create_chat_completion.
+
+    Args:
+        client: OpenAI client to send the request with
+        request: Keyword arguments for embeddings.create
+
+    Returns:
+        The embeddings response
+    """
+    bucket = get_bucket(request['model'])
+    async with bucket.in_flight:
+        await bucket.acquire(estimate_tokens(request))
+
+        try:
+            return await client.embeddings.create(**request)
+        except openai.RateLimitError as e:
+            await bucket.pause(_retry_after_seconds(e) or 1.0)
+            raise
+
+
+async def probe_limits(client: AsyncOpenAI, model: str):
+    """
+    Learn the account's real limits for a model from a 1-token request.
+
+    OpenAI reports the limits in x-ratelimit-* response headers; the
+    configured defaults stay in place if the probe fails.
+
+    Args:
+        client: OpenAI client to send the probe with
+        model: Model whose limits to probe
+    """
+    try:
+        raw = await client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1
+        )
+        requests_per_minute = int(raw.headers['x-ratelimit-limit-requests'])
+        tokens_per_minute = int(raw.headers['x-ratelimit-limit-tokens'])
+    except (openai.OpenAIError, KeyError, ValueError) as e:
+        print(f"  Warning: Could not probe rate limits for {model}, using defaults: {e}")
+        return
+
+    await get_bucket(model).update_limits(requests_per_minute, tokens_per_minute)
+    print(f"  Rate limits for {model}: {requests_per_minute} requests/min, {tokens_per_minute} tokens/min")
@@ -2,116 +2,575 @@
 Tax category matching module.
 Loads tax rates and provides matching logic for product descriptions.
 """
+import asyncio
 import csv
-from typing import Dict, Optional
-from openai import OpenAI
+import io
+import json
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+import numpy as np
+from charset_normalizer import from_bytes
+from cache import DiskCache, sha256_hex
+from clients import get_client
 from config import Config
+from openai import AsyncOpenAI
+from rate_limiter import create_chat_completion, create_embedding
+
+
+# Bump whenever the classification prompt changes so cached classifications are invalidated
+PROMPT_VERSION = "4"
+
+# Shared with the extractor, which can classify line items in the same call as extraction
+CLASSIFICATION_RULES = """IMPORTANT CLASSIFICATION RULES:
+1. Choose the MOST SPECIFIC category that matches the product
+2. For automotive products:
+   - Use "Car Batteries" for automotive/vehicle batteries (AGM, lead-acid, etc.)
+   - Use "Batteries" only for household batteries (AA, AAA, D, etc.)
+   - Use "Motor Oil" for engine oils and lubricants
+   - Use "Automotive Parts" for general auto parts (filters, spark plugs, brake pads)
+   - Use "Tires" for vehicle tires
+3. For beverages:
+   - Use "Alcoholic Beverages" for beer, wine, spirits
+   - Use "Soft Drinks" for soda, carbonated drinks
+   - Use "Coffee & Tea" for coffee and tea products
+   - Use "Bottled Water" for plain water
+4. Always prefer specific categories over general ones
+5. Look for brand names and technical specifications as clues (e.g., "CCA" indicates car battery)"""
+
+SYSTEM_PROMPT_TEMPLATE = """You are a precise tax classification expert for retail products. For EACH numbered product description the user sends, identify the MOST SPECIFIC and appropriate tax category from the list of categories. Always prefer specific categories (e.g., 'Car Batteries') over general ones (e.g., 'Batteries').
+
+Available Tax Categories:
+{categories}
+
+{rules}
+
+Return a JSON object with one assignment per product, where index is the product's number:
+{{"assignments": [{{"index": 1, "category": "exact category name from the list above"}}]}}
+Do not include explanation."""
+
+# Unambiguous patterns that can be classified without asking the model
+KEYWORD_RULES = [
+    (re.compile(r'\bcca\b'), "Car Batteries"),  # Cold cranking amps only appear on vehicle batteries
+]
+
+# Product words and phrases that name one category when they are the product itself.
+# Matched as whole words on the normalized description, longest first, and only used when
+# the keyword is the head noun: nothing but sizes and counts may follow it ("vodka 750ml",
+# not "vodka glasses") and no preposition may precede it ("glass for vodka"). Everything
+# else, and anything ambiguous on its own (e.g. "milk" vs "milk chocolate"), goes to the model.
+KEYWORD_TO_CATEGORY = {
+    "bottled water": "Bottled Water",
+    "spring water": "Bottled Water",
+    "ground coffee": "Coffee & Tea",
+    "coffee beans": "Coffee & Tea",
+    "tea bags": "Coffee & Tea",
+    "vodka": "Alcoholic Beverages",
+    "whiskey": "Alcoholic Beverages",
+    "tequila": "Alcoholic Beverages",
+    "cigarettes": "Tobacco Products",
+    "cigars": "Tobacco Products",
+    "ibuprofen": "Over-the-Counter Medicine",
+    "acetaminophen": "Over-the-Counter Medicine",
+    "multivitamin": "Vitamins & Supplements",
+    "laundry detergent": "Laundry Detergent",
+    "dish soap": "Dish Soap",
+    "dishwashing liquid": "Dish Soap",
+    "paper towels": "Paper Towels",
+    "toilet paper": "Toilet Paper",
+    "toilet tissue": "Toilet Paper",
+    "trash bags": "Trash Bags",
+    "garbage bags": "Trash Bags",
+    "light bulb": "Light Bulbs",
+    "light bulbs": "Light Bulbs",
+    "motor oil": "Motor Oil",
+    "potting soil": "Fertilizer & Soil",
+    "fertilizer": "Fertilizer & Soil",
+    "dog food": "Pet Food",
+    "cat food": "Pet Food",
+    "paperback": "Books (Physical)",
+    "hardcover": "Books (Physical)",
+}
+
+# Tokens that can follow a keyword without changing what the product is
+SIZE_TOKEN = re.compile(r'(?:\d+(?:\.\d+)?)?(?:ml|l|oz|fl|lb|lbs|g|kg|mg|ct|count|pk|pack|roll|rolls|sheet|sheets'
+                        r'|tablets|caplets|capsules|pc|pcs|gal|w|watt)?|x|×')
+PREPOSITIONS = re.compile(r'\b(?:for|with|of)\b')
+
+
+def normalize_description(product_description: Optional[str]) -> str:
+    """Normalize a description so trivially different spellings share cache entries."""
+    # The extraction returns null for descriptions it can't read
+    return re.sub(r'\s+', ' ', (product_description or '').strip().lower())
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize row vectors to int8 with one scale per row.
+
+    Args:
+        vectors: Float matrix, one vector per row
+
+    Returns:
+        Tuple of (int8 codes, float32 column of row scales); codes * scales approximates vectors
+    """
+    scales = np.abs(vectors).max(axis=1, keepdims=True) / 127
+    scales[scales == 0] = 1.0  # All-zero rows stay zero
+    codes = np.round(vectors / scales).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def load_tax_rates(path: str) -> Mapping[str, float]:
+    """
+    Load tax categories and rates from the CSV file, once per process.
+
+    Args:
+        path: Path to the tax rates CSV
+
+    Returns:
+        Read-only mapping of category name to tax rate (%), in file order
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    # Strict UTF-8 (with or without a BOM) first; a short legacy file has too few
+    # non-ASCII bytes for detection to tell similar code pages apart reliably
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        best = from_bytes(raw).best()
+        text = str(best) if best is not None else raw.decode('latin-1')
+
+    tax_rates: Dict[str, float] = {}
+    try:
+        for row in csv.DictReader(io.StringIO(text, newline='')):
+            tax_rates[row['Category'].strip()] = float(row['Tax Rate (%)'].strip())
+    except KeyError:
+        tax_rates.clear()
+
+    if not tax_rates:
+        raise ValueError(f"Could not load tax rates from {path}")
+
+    # Shared by every TaxMatcher, so hand out a view that can't be modified
+    return MappingProxyType(tax_rates)
 
 
 class TaxMatcher:
     """Matches product descriptions to tax categories using AI-powered classification."""
 
-    def __init__(self):
-        """Initialize the tax matcher with tax rates from CSV."""
-        self.tax_rates: Dict[str, float] = {}
-        self.categories: list[str] = []
-        self._load_tax_rates()
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
-        self.last_prompt_tokens = 0
-        self.last_completion_tokens = 0
-
-    def _load_tax_rates(self):
-        """Load tax categories and rates from CSV file."""
-        # Try different encodings to handle special characters
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-
-        for encoding in encodings:
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        """
+        Initialize the tax matcher with tax rates from CSV.
+
+        Args:
+            client: OpenAI client to send requests with (defaults to the shared client)
+        """
+        self.tax_rates: Mapping[str, float] = load_tax_rates(Config.TAX_RATES_FILE)
+        self.categories: list[str] = list(self.tax_rates)
+        self.top5_categories: list[str] = self.categories[:5]  # Preview shown in test output
+        # Category names by lowercased, whitespace-trimmed form, so a reply with different
+        # casing or padding still resolves with one dict lookup
+        self._categories_by_key: Dict[str, str] = {
+            category.strip().lower(): category for category in self.categories
+        }
+        self.client = client or get_client()
+        self.cache = DiskCache("classifications", ttl=Config.CLASSIFICATION_CACHE_TTL)
+        self._memory: OrderedDict[str, str] = OrderedDict()  # In-process LRU of normalized description -> category
+        self._categories_hash = sha256_hex("\n".join(self.categories).encode('utf-8'))
+        # Unit-length category name embeddings for the embedding backend, fetched on first use and
+        # kept as int8 codes plus per-row scales (a quarter of the float32 size)
+        self.embedding_cache = DiskCache("category_embeddings")
+        self._category_codes: Optional[np.ndarray] = None
+        self._category_scales: Optional[np.ndarray] = None
+        self._category_vectors_lock = asyncio.Lock()
+
+        # One alternation over every keyword, so a description is scanned once instead of per keyword
+        keywords = sorted((keyword for keyword, category in KEYWORD_TO_CATEGORY.items()
+                           if category in self.tax_rates), key=len, reverse=True)
+        self._keyword_pattern: Optional[re.Pattern] = (
+            re.compile(r'\b(?:' + '|'.join(map(re.escape, keywords)) + r')\b', re.IGNORECASE)
+            if keywords else None
+        )
+
+        # The category list never changes, so the system prompt is built once. Keeping it
+        # as an identical prefix on every request also lets OpenAI's prompt caching discount it.
+        self._categories_block = "\n".join(f"- {cat}" for cat in self.categories)
+        self._system_prompt = SYSTEM_PROMPT_TEMPLATE.format(categories=self._categories_block,
+                                                            rules=CLASSIFICATION_RULES)
+
+        # Structured outputs constrain every category to the known list, so replies never need fuzzy matching
+        self._response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "classification",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "assignments": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "index": {"type": "integer"},
+                                    "category": {"type": "string", "enum": self.categories}
+                                },
+                                "required": ["index", "category"],
+                                "additionalProperties": False
+                            }
+                        }
+                    },
+                    "required": ["assignments"],
+                    "additionalProperties": False
+                }
+            }
+        }
+
+    def build_classification_request(self, product_descriptions: List[str]) -> Dict[str, Any]:
+        """
+        Build one chat completion request body classifying several products.
+
+        All line items of an invoice go into a single request so the category
+        list is only sent (and billed) once. The same body is used for live
+        calls and for Batch API submissions.
+
+        Args:
+            product_descriptions: Descriptions of the products from the invoice
+
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        products_list = "\n".join(f"{index}. {description}"
+                                  for index, description in enumerate(product_descriptions, 1))
+
+        return {
+            "model": Config.CLASSIFICATION_MODEL,
+            "messages": [
+                {"role": "system", "content": self._system_prompt},
+                {"role": "user", "content": f"Product Descriptions:\n{products_list}"}
+            ],
+            "temperature": 0.0,  # Set to 0 for maximum consistency
+            "max_tokens": 10 + 20 * len(product_descriptions),
+            "response_format": self._response_format
+        }
+
+    def default_match(self) -> tuple[str, float]:
+        """Category used when a product cannot be classified."""
+        return "Packaged Snacks", self.tax_rates.get("Packaged Snacks", 4.0)
+
+    def known_match(self, category: Optional[str]) -> Optional[tuple[str, float]]:
+        """Return (category, tax_rate) if category names a known tax category (ignoring case), else None."""
+        if category is None:
+            return None
+        category = self._categories_by_key.get(category.strip().lower())
+        if category is None:
+            return None
+        return category, self.tax_rates[category]
+
+    def parse_classification_response(self, content: str,
+                                      product_descriptions: List[str]) -> List[tuple[str, float]]:
+        """
+        Map the model's JSON reply onto known tax categories.
+
+        The response schema guarantees every category is a known one. Answered
+        descriptions are cached; descriptions the model skipped fall back to
+        the default category and are not cached.
+
+        Args:
+            content: Raw message content returned by the model
+            product_descriptions: Descriptions that were classified, in request order
+
+        Returns:
+            List of (category_name, tax_rate), aligned with product_descriptions
+        """
+        assignments = json.loads(content).get('assignments', [])
+        categories_by_index = {}
+        for assignment in assignments:
             try:
-                with open(Config.TAX_RATES_FILE, 'r', encoding=encoding) as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        category = row['Category'].strip()
-                        tax_rate = float(row['Tax Rate (%)'].strip())
-                        self.tax_rates[category] = tax_rate
-                        self.categories.append(category)
-                break  # Successfully loaded
-            except (UnicodeDecodeError, KeyError):
-                # Try next encoding
-                self.tax_rates.clear()
-                self.categories.clear()
+                categories_by_index[int(assignment['index'])] = str(assignment['category'])
+            except (KeyError, TypeError, ValueError):
                 continue
 
-        if not self.tax_rates:
-            raise ValueError(f"Could not load tax rates from {Config.TAX_RATES_FILE}")
+        matches = []
+        for index, description in enumerate(product_descriptions, 1):
+            match = self.known_match(categories_by_index.get(index))
+            if match is None:
+                print(f"Warning: No category returned for product '{description}'. Using default.")
+                matches.append(self.default_match())
+                continue
+            self.cache_match(description, match[0])
+            matches.append(match)
+        return matches
 
-    def match_category(self, product_description: str) -> tuple[str, float]:
+    @staticmethod
+    def build_tax_exempt_request(notes: str) -> Dict[str, Any]:
         """
-        Match a product description to a tax category using GPT-4.
+        Build the chat completion request body for the tax-exempt check.
+
+        Args:
+            notes: Invoice notes text
+
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        prompt = f"""You are a tax compliance expert. Analyze the following invoice notes and determine if this invoice should be TAX-EXEMPT (no taxes should be applied).
+
+Invoice Notes: "{notes}"
+
+Look for any indication that:
+- Tax should not be applied
+- Items are tax-exempt
+- Invoice is tax-free
+- No tax is required
+- Tax is waived or not applicable
+
+Respond with ONLY "YES" if the invoice is tax-exempt, or "NO" if taxes should be applied normally.
+Do not include any explanation."""
+
+        return {
+            "model": Config.CLASSIFICATION_MODEL,
+            "messages": [
+                {"role": "system", "content": "You are a tax compliance expert. Answer only YES or NO."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.0,
+            "max_tokens": 10
+        }
+
+    @staticmethod
+    def parse_tax_exempt_response(content: str) -> bool:
+        """Interpret the model's YES/NO reply to the tax-exempt check."""
+        return content.strip().upper() == "YES"
+
+    def _cache_key(self, normalized_description: str) -> str:
+        """Key a classification by description, category set, model and prompt version."""
+        return f"{normalized_description}:{self._categories_hash}:{Config.CLASSIFICATION_MODEL}:{PROMPT_VERSION}"
+
+    def _remember(self, normalized_description: str, category: str):
+        """Add a classification to the in-process LRU, evicting the oldest entry when full."""
+        self._memory[normalized_description] = category
+        self._memory.move_to_end(normalized_description)
+        if len(self._memory) > Config.CLASSIFICATION_MEMORY_SIZE:
+            self._memory.popitem(last=False)
+
+    def _keyword_match(self, normalized: str) -> Optional[str]:
+        """Category of a keyword that is the head noun of a normalized description, if any."""
+        if self._keyword_pattern is None:
+            return None
+        for match in self._keyword_pattern.finditer(normalized):
+            tail = re.split(r'[\s,()/-]+', normalized[match.end():])
+            if PREPOSITIONS.search(normalized[:match.start()]) is None \
+                    and all(SIZE_TOKEN.fullmatch(token) for token in tail if token):
+                return KEYWORD_TO_CATEGORY[match.group(0).lower()]
+        return None
+
+    def get_cached_match(self, product_description: Optional[str]) -> Optional[tuple[str, float]]:
+        """
+        Classify a description without calling the model, if possible.
+
+        Blank (or missing) descriptions get the default category; others are
+        checked against the keyword rules, then the in-process LRU, then the
+        disk cache.
 
         Args:
             product_description: Description of the product from invoice
 
         Returns:
-            Tuple of (category_name, tax_rate)
+            Tuple of (category_name, tax_rate), or None if the model is needed
         """
-        categories_list = "\n".join([f"- {cat}" for cat in self.categories])
+        normalized = normalize_description(product_description)
+        if not normalized:
+            # Nothing to classify, and the embeddings endpoint rejects empty input
+            return self.default_match()
 
-        prompt = f"""You are a tax classification expert for retail products. Given a product description, identify the MOST SPECIFIC and appropriate tax category from the list below.
+        for pattern, category in KEYWORD_RULES:
+            if pattern.search(normalized) and category in self.tax_rates:
+                return category, self.tax_rates[category]
 
-Product Description: {product_description}
+        category = self._keyword_match(normalized)
+        if category is not None:
+            return category, self.tax_rates[category]
 
-Available Tax Categories:
-{categories_list}
+        category = self._memory.get(normalized)
+        if category is not None:
+            self._memory.move_to_end(normalized)
+            return category, self.tax_rates[category]
 
-IMPORTANT CLASSIFICATION RULES:
-1. Choose the MOST SPECIFIC category that matches the product
-2. For automotive products:
-   - Use "Car Batteries" for automotive/vehicle batteries (AGM, lead-acid, etc.)
-   - Use "Batteries" only for household batteries (AA, AAA, D, etc.)
-   - Use "Motor Oil" for engine oils and lubricants
-   - Use "Automotive Parts" for general auto parts (filters, spark plugs, brake pads)
-   - Use "Tires" for vehicle tires
-3. For beverages:
-   - Use "Alcoholic Beverages" for beer, wine, spirits
-   - Use "Soft Drinks" for soda, carbonated drinks
-   - Use "Coffee & Tea" for coffee and tea products
-   - Use "Bottled Water" for plain water
-4. Always prefer specific categories over general ones
-5. Look for brand names and technical specifications as clues (e.g., "CCA" indicates car battery)
+        category = self.cache.get(self._cache_key(normalized))
+        if category in self.tax_rates:
+            self._remember(normalized, category)
+            return category, self.tax_rates[category]
+        return None
+
+    def cache_match(self, product_description: str, category: str):
+        """Remember a classification for the rest of this run and future runs."""
+        normalized = normalize_description(product_description)
+        self._remember(normalized, category)
+        self.cache.put(self._cache_key(normalized), category)
+
+    async def _classify_chunk(self, product_descriptions: List[str],
+                              semaphore: asyncio.Semaphore) -> tuple[List[tuple[str, float]], int, int]:
+        """Classify one chunk of uncached descriptions, returning (matches, prompt_tokens, completion_tokens)."""
+        async with semaphore:
+            try:
+                response = await create_chat_completion(self.client,
+                                                        self.build_classification_request(product_descriptions))
+            except Exception as e:
+                print(f"Error matching categories for {len(product_descriptions)} products: {e}")
+                return [self.default_match() for _ in product_descriptions], 0, 0
 
-Return ONLY the exact category name from the list above. Do not include explanation."""
+        # Capture token usage
+        prompt_tokens = completion_tokens = 0
+        if hasattr(response, 'usage') and response.usage:
+            prompt_tokens = response.usage.prompt_tokens
+            completion_tokens = response.usage.completion_tokens
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using mini for cost efficiency on simple classification
-                messages=[
-                    {"role": "system", "content": "You are a precise tax category classifier. You must select the most specific matching category from the provided list. Always prefer specific categories (e.g., 'Car Batteries') over general ones (e.g., 'Batteries')."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0,  # Set to 0 for maximum consistency
-                max_tokens=50
-            )
-
-            # Capture token usage
-            if hasattr(response, 'usage') and response.usage:
-                self.last_prompt_tokens = response.usage.prompt_tokens
-                self.last_completion_tokens = response.usage.completion_tokens
-
-            category = response.choices[0].message.content.strip()
-
-            # Validate that the returned category exists
-            if category in self.tax_rates:
-                return category, self.tax_rates[category]
+            matches = self.parse_classification_response(response.choices[0].message.content,
+                                                         product_descriptions)
+        except Exception as e:
+            print(f"Error matching categories for {len(product_descriptions)} products: {e}")
+            matches = [self.default_match() for _ in product_descriptions]
+        return matches, prompt_tokens, completion_tokens
+
+    async def _embed(self, texts: List[str]) -> tuple[np.ndarray, int]:
+        """Embed texts in one request, returning (unit-length row vectors, prompt_tokens)."""
+        response = await create_embedding(self.client, {"model": Config.EMBEDDING_MODEL, "input": texts})
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        prompt_tokens = response.usage.prompt_tokens if getattr(response, 'usage', None) else 0
+        return vectors, prompt_tokens
+
+    async def _load_category_vectors(self) -> int:
+        """Make sure the quantized category embeddings are loaded, returning the tokens spent (0 once known)."""
+        async with self._category_vectors_lock:
+            if self._category_codes is not None:
+                return 0
+
+            key = f"{Config.EMBEDDING_MODEL}:{self._categories_hash}"
+            prompt_tokens = 0
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                vectors = np.array(cached, dtype=np.float32)
             else:
-                # Fallback: try to find closest match
-                for valid_category in self.categories:
-                    if valid_category.lower() in category.lower() or category.lower() in valid_category.lower():
-                        return valid_category, self.tax_rates[valid_category]
+                vectors, prompt_tokens = await self._embed(self.categories)
+                self.embedding_cache.put(key, vectors.tolist())
+
+            self._category_codes, self._category_scales = quantize_int8(vectors)
+            return prompt_tokens
 
-                # If no match found, return a default category
-                print(f"Warning: Could not match category '{category}' for product '{product_description}'. Using default.")
-                return "Packaged Snacks", self.tax_rates.get("Packaged Snacks", 4.0)
+    def _nearest_categories(self, description_vectors: np.ndarray) -> np.ndarray:
+        """Index of the most similar category for each description vector, using the int8 matrices."""
+        codes, scales = quantize_int8(description_vectors)
+        similarities = (codes.astype(np.int32) @ self._category_codes.T.astype(np.int32)) \
+            * (scales * self._category_scales.T)
+        return similarities.argmax(axis=1)
+
+    async def match_categories_embed(self,
+                                     product_descriptions: List[str]) -> tuple[List[tuple[str, float]], int, int]:
+        """
+        Match product descriptions to the tax categories with the most similar embeddings.
 
+        Descriptions the keyword rules or the cache resolve (or that are
+        blank) are left out; the rest are embedded in one request and each
+        gets the category whose name embedding has the highest cosine
+        similarity. Picks are kept in the in-process LRU (not
+        the disk cache), so later calls in the run don't embed them again.
+
+        Args:
+            product_descriptions: Descriptions of the products from invoice
+
+        Returns:
+            Tuple of (matches, prompt_tokens, completion_tokens) like match_categories;
+            completion_tokens is always 0
+        """
+        matches: List[Optional[tuple[str, float]]] = [
+            self.get_cached_match(description) for description in product_descriptions
+        ]
+        pending_by_key: Dict[str, str] = {}
+        for description, match in zip(product_descriptions, matches):
+            if match is None:
+                pending_by_key.setdefault(normalize_description(description), description)
+        if not pending_by_key:
+            return matches, 0, 0
+
+        try:
+            category_tokens = await self._load_category_vectors()
+            description_vectors, prompt_tokens = await self._embed(list(pending_by_key.values()))
         except Exception as e:
-            print(f"Error matching category for '{product_description}': {e}")
-            return "Packaged Snacks", self.tax_rates.get("Packaged Snacks", 4.0)
+            print(f"Error embedding {len(pending_by_key)} products: {e}")
+            return [match or self.default_match() for match in matches], 0, 0
+
+        best = self._nearest_categories(description_vectors)
+        resolved = {key: (self.categories[index], self.tax_rates[self.categories[index]])
+                    for key, index in zip(pending_by_key, best)}
+        for key, (category, _) in resolved.items():
+            self._remember(key, category)
+        matches = [match if match is not None else resolved[normalize_description(description)]
+                   for description, match in zip(product_descriptions, matches)]
+        return matches, category_tokens + prompt_tokens, 0
+
+    async def match_categories(self,
+                               product_descriptions: List[str]) -> tuple[List[tuple[str, float]], int, int]:
+        """
+        Match several product descriptions to tax categories with GPT-4 Mini.
+
+        Descriptions classified on a previous run come from the cache and blank
+        ones get the default category; both are left out of the request, and
+        repeated descriptions (the same product on several rows) are only
+        sent once. The rest go out in chunks of
+        Config.CLASSIFICATION_CHUNK_SIZE (one request for a typical invoice),
+        sent concurrently so long invoices cost about one round-trip.
+        With Config.CLASSIFICATION_BACKEND = "embedding" this defers to
+        match_categories_embed instead.
+
+        Args:
+            product_descriptions: Descriptions of the products from invoice
+
+        Returns:
+            Tuple of (matches, prompt_tokens, completion_tokens), where matches
+            is a list of (category_name, tax_rate) aligned with product_descriptions
+        """
+        if Config.CLASSIFICATION_BACKEND == "embedding":
+            return await self.match_categories_embed(product_descriptions)
+
+        matches: List[Optional[tuple[str, float]]] = [
+            self.get_cached_match(description) for description in product_descriptions
+        ]
+        # One request slot per distinct normalized description, fanned back out below
+        pending_by_key: Dict[str, str] = {}
+        for description, match in zip(product_descriptions, matches):
+            if match is None:
+                pending_by_key.setdefault(normalize_description(description), description)
+        pending = list(pending_by_key.values())
+
+        chunk_size = Config.CLASSIFICATION_CHUNK_SIZE
+        semaphore = asyncio.Semaphore(Config.CLASSIFICATION_CONCURRENCY)
+        chunk_results = await asyncio.gather(*(
+            self._classify_chunk(pending[start:start + chunk_size], semaphore)
+            for start in range(0, len(pending), chunk_size)
+        ))
+
+        resolved = dict(zip(pending_by_key,
+                            (match for chunk_matches, _, _ in chunk_results for match in chunk_matches)))
+        matches = [match if match is not None else resolved[normalize_description(description)]
+                   for description, match in zip(product_descriptions, matches)]
+        return (matches,
+                sum(prompt_tokens for _, prompt_tokens, _ in chunk_results),
+                sum(completion_tokens for _, _, completion_tokens in chunk_results))
+
+    async def match_category(self, product_description: str) -> tuple[str, float, int, int]:
+        """
+        Match a product description to a tax category using GPT-4.
+
+        Args:
+            product_description: Description of the product from invoice
+
+        Returns:
+            Tuple of (category_name, tax_rate, prompt_tokens, completion_tokens)
+        """
+        matches, prompt_tokens, completion_tokens = await self.match_categories([product_description])
+        category, tax_rate = matches[0]
+        return category, tax_rate, prompt_tokens, completion_tokens
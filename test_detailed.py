@@ -1,145 +1,469 @@
 """
 Detailed test script showing OpenAI responses and categorization process.
 """
+import argparse
+import asyncio
+import io
+import logging
+import os
+import textwrap
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from typing import Any, Dict, List, Optional
+from openai import AsyncOpenAI
+from batch_api import run_invoice_batches
+from clients import client_session, get_client, warm_up
 from config import Config
 from invoice_extractor import InvoiceExtractor
+from rate_limiter import probe_limits
 from tax_matcher import TaxMatcher
-import json
 import sys
+import numpy as np
+import orjson
 
 
-def test_detailed():
-    """Test with detailed output showing all AI responses."""
-    print("=" * 80)
-    print("DETAILED INVOICE PROCESSING TEST")
-    print("=" * 80)
+SEP = "-" * 80
+DBL = "=" * 80
+
+DEFAULT_TEST_FILE = "Invoices/2025-10-10 16-00.pdf"
+
+# Report block for one line item, filled in with str.format
+ITEM_TEMPLATE = textwrap.dedent("""
+    {sep}
+    LINE ITEM #{idx}
+    {sep}
+    Description: {desc}
+    Quantity: {qty}
+    Unit Price: ${unit:.2f}
+    Line Total: ${total:.2f}
+
+    ← Tax Classification:
+       Tax Category: '{cat}'
+       Tax Rate: {rate}%
+
+       Calculation:
+       ${total:.2f} × {rate}% = ${tax:.2f} (tax)
+       ${total:.2f} + ${tax:.2f} = ${grand:.2f} (total)""")
+
+# Report lines are collected here and written out in one go at each step boundary
+_buf = io.StringIO()
+
+# The report goes through this logger into the buffer; the raw extraction dump is
+# logged at debug level, so it is never serialized unless --verbose is on
+logger = logging.getLogger("eranova.test")
+logger.setLevel(logging.DEBUG if Config.DEBUG_JSON else logging.INFO)
+logger.propagate = False
+_handler = logging.StreamHandler(_buf)
+_handler.setFormatter(logging.Formatter("%(message)s"))
+logger.addHandler(_handler)
+
+
+def p(*args):
+    """Log a report line at info level (print-style, space-separated)."""
+    logger.info(" ".join(map(str, args)))
+
+
+def flush_output():
+    """Write the buffered report to stdout and empty the buffer."""
+    sys.stdout.write(_buf.getvalue())
+    sys.stdout.flush()
+    _buf.seek(0)
+    _buf.truncate()
+
+
+async def run_batch(pdf_paths: List[str], extractor: InvoiceExtractor,
+                    tax_matcher: TaxMatcher) -> Dict[str, tuple[Dict[str, Any], List[tuple[str, float]], int, int]]:
+    """
+    Extract and classify invoices through the OpenAI Batch API instead of live calls.
+
+    Runs the same two batch jobs as main.py --batch, minus the tax-exempt
+    check: like the live path, the detailed report shows the full tax.
+
+    Args:
+        pdf_paths: Invoice PDFs to process
+        extractor: Extractor building and parsing the extraction requests
+        tax_matcher: Matcher building and parsing the classification requests
+
+    Returns:
+        (extracted_data, classifications, prompt_tokens, completion_tokens) keyed by PDF path
+    """
+    results = await run_invoice_batches(pdf_paths, extractor, tax_matcher, check_tax_exempt=False)
+    return {path: (data, classifications, prompt_tokens, completion_tokens)
+            for path, (data, _, classifications, prompt_tokens, completion_tokens) in results.items()}
+
+
+async def test_detailed(client: Optional[AsyncOpenAI] = None,
+                        test_file: str = DEFAULT_TEST_FILE,
+                        batch_result: Optional[tuple] = None) -> Optional[Dict[str, Any]]:
+    """
+    Test with detailed output showing all AI responses.
+
+    Args:
+        client: OpenAI client shared by the components (defaults to the shared client)
+        test_file: Invoice PDF to process
+        batch_result: This PDF's entry from a run_batch call already made for
+            several PDFs (batch mode only; submits its own batch jobs when omitted)
+
+    Returns:
+        Summary with the invoice's line-item count, totals and token usage,
+        or None if the test failed
+    """
+    p(DBL)
+    p("DETAILED INVOICE PROCESSING TEST")
+    p(DBL)
 
     # Validate config
     try:
         Config.validate()
-        print("\n✓ Configuration validated")
-        print(f"  OpenAI API Key: {Config.OPENAI_API_KEY[:20]}...{Config.OPENAI_API_KEY[-10:]}")
-        print(f"  Model: {Config.OPENAI_MODEL}")
+        p("\n✓ Configuration validated")
+        p(f"  OpenAI API Key: {Config.OPENAI_API_KEY[:20]}...{Config.OPENAI_API_KEY[-10:]}")
+        p(f"  Model: {Config.OPENAI_MODEL}")
     except Exception as e:
-        print(f"✗ Configuration Error: {e}")
-        return False
+        p(f"✗ Configuration Error: {e}")
+        flush_output()
+        return None
+
+    p("\n" + DBL)
+    p("STEP 1: INITIALIZING COMPONENTS")
+    p(DBL)
 
-    print("\n" + "=" * 80)
-    print("STEP 1: INITIALIZING COMPONENTS")
-    print("=" * 80)
+    # Initialize tax matcher (its categories go into the extraction prompt when fused)
+    p("\n1.1 Initializing Tax Matcher (GPT-4 Mini)...")
+    tax_matcher = TaxMatcher(client=client)
+    p(f"  ✓ Loaded {len(tax_matcher.tax_rates)} tax categories")
+    p(f"  Categories: {', '.join(tax_matcher.top5_categories)}...")
 
     # Initialize extractor
-    print("\n1.1 Initializing Invoice Extractor (GPT-4 Vision)...")
-    extractor = InvoiceExtractor()
-    print("  ✓ Invoice Extractor ready")
+    p("\n1.2 Initializing Invoice Extractor (GPT-4 Vision)...")
+    extractor = InvoiceExtractor(
+        categories=tax_matcher.categories if Config.FUSED_CLASSIFICATION else None,
+        client=client
+    )
+    # Read and render the test PDF in the background while the rest of the setup runs
+    render_pool = ThreadPoolExecutor(max_workers=1)
+    if batch_result is None:
+        extractor.prefetch_pdf_content(test_file, render_pool)
+    if extractor.classifies_line_items:
+        p("  ✓ Invoice Extractor ready (classifies line items during extraction)")
+    else:
+        p("  ✓ Invoice Extractor ready")
 
-    # Initialize tax matcher
-    print("\n1.2 Initializing Tax Matcher (GPT-4 Mini)...")
-    tax_matcher = TaxMatcher()
-    print(f"  ✓ Loaded {len(tax_matcher.tax_rates)} tax categories")
-    print(f"  Categories: {', '.join(list(tax_matcher.tax_rates.keys())[:5])}...")
+    # Pace live calls against the account's real limits (batch jobs have their own pool)
+    if Config.PROBE_RATE_LIMITS and not Config.USE_BATCH_API:
+        p("\n1.3 Checking OpenAI rate limits...")
+        flush_output()
+        for model in (Config.OPENAI_MODEL, Config.CLASSIFICATION_MODEL):
+            await probe_limits(extractor.client, model)
 
-    print("\n" + "=" * 80)
-    print("STEP 2: EXTRACTING INVOICE DATA")
-    print("=" * 80)
+    p("\n" + DBL)
+    p("STEP 2: EXTRACTING INVOICE DATA")
+    p(DBL)
 
-    test_file = "Invoices/2025-10-10 16-00.pdf"
-    print(f"\nProcessing: {test_file}")
-    print("\nSending PDF to GPT-4 Vision API...")
-    print("(This will take a few seconds...)\n")
+    p(f"\nProcessing: {test_file}")
 
     try:
-        # Extract invoice data
-        extracted_data = extractor.extract_invoice_data(test_file)
-
-        print("✓ EXTRACTION COMPLETE!")
-        print("\n" + "-" * 80)
-        print("RAW EXTRACTED DATA (from GPT-4 Vision):")
-        print("-" * 80)
-        print(json.dumps(extracted_data, indent=2))
-
-        print("\n" + "-" * 80)
-        print("EXTRACTED INVOICE METADATA:")
-        print("-" * 80)
-        print(f"  Invoice Number: {extracted_data.get('invoice_number', 'N/A')}")
-        print(f"  Vendor: {extracted_data.get('vendor_name', 'N/A')}")
-        print(f"  Date: {extracted_data.get('invoice_date', 'N/A')}")
-        print(f"  Line Items: {len(extracted_data.get('line_items', []))}")
-
-        print("\n" + "=" * 80)
-        print("STEP 3: TAX CLASSIFICATION FOR EACH LINE ITEM")
-        print("=" * 80)
+        classifications = None
+        # Line items are classified in chunks while the extraction is still streaming;
+        # a full chunk of descriptions goes out as soon as it has been read
+        streamed_descriptions: List[str] = []
+        classification_tasks = []
+
+        def classify_streamed_item(item: Dict[str, Any]):
+            # Items the extraction already put in a known category need no classification call
+            if tax_matcher.known_match(item.get('tax_category')) is not None:
+                return
+            description = item.get('description', '')
+            # Repeated rows (and items re-reported by a high-detail retry) are classified once
+            if description in streamed_descriptions:
+                return
+            streamed_descriptions.append(description)
+            if len(streamed_descriptions) % Config.CLASSIFICATION_CHUNK_SIZE == 0:
+                chunk = streamed_descriptions[-Config.CLASSIFICATION_CHUNK_SIZE:]
+                classification_tasks.append(asyncio.create_task(tax_matcher.match_categories(chunk)))
+
+        if batch_result is not None:
+            p("\nUsing the results of the shared batch jobs\n")
+            flush_output()
+            extracted_data, classifications, total_prompt_tokens, total_completion_tokens = batch_result
+        elif Config.USE_BATCH_API:
+            p("\nSubmitting PDF to the OpenAI Batch API...")
+            p("(This can take up to 24 hours...)\n")
+            flush_output()
+            # Extraction and classification both come back from the batch jobs
+            extracted_data, classifications, total_prompt_tokens, total_completion_tokens = \
+                (await run_batch([test_file], extractor, tax_matcher))[test_file]
+        else:
+            p("\nSending PDF to GPT-4 Vision API...")
+            p("(This will take a few seconds...)\n")
+            flush_output()
+
+            # Extract invoice data, streaming line items out as they are generated
+            extracted_data, total_prompt_tokens, total_completion_tokens = \
+                await extractor.extract_invoice_data(test_file, on_line_item=classify_streamed_item)
+
+        p("✓ EXTRACTION COMPLETE!")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n%s\nRAW EXTRACTED DATA (from GPT-4 Vision):\n%s", SEP, SEP)
+            logger.debug("%s", orjson.dumps(extracted_data,
+                                            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode())
+
+        p("\n" + SEP)
+        p("EXTRACTED INVOICE METADATA:")
+        p(SEP)
+        p(f"  Invoice Number: {extracted_data.get('invoice_number', 'N/A')}")
+        p(f"  Vendor: {extracted_data.get('vendor_name', 'N/A')}")
+        p(f"  Date: {extracted_data.get('invoice_date', 'N/A')}")
+        p(f"  Line Items: {len(extracted_data.get('line_items', []))}")
+
+        p("\n" + DBL)
+        p("STEP 3: TAX CLASSIFICATION FOR EACH LINE ITEM")
+        p(DBL)
 
         line_items = extracted_data.get('line_items', [])
-        total_pre_tax = 0.0
-        total_tax = 0.0
 
-        for idx, item in enumerate(line_items, 1):
+        if classifications is None:
+            # Categories the extraction returned are used as-is (with the rates from the
+            # local tax table); only the rest need GPT-4 Mini
+            classifications = [tax_matcher.known_match(item.get('tax_category')) for item in line_items]
+            unmatched = [i for i, match in enumerate(classifications) if match is None]
+            p(f"\n→ {len(line_items) - len(unmatched)} products classified during extraction")
+
+            # Chunks classified during streaming are remembered by the matcher, so only the
+            # remaining items go out here, in one request
+            for _, prompt_tokens, completion_tokens in await asyncio.gather(*classification_tasks):
+                total_prompt_tokens += prompt_tokens
+                total_completion_tokens += completion_tokens
+            if unmatched:
+                classifier = "text embeddings" if Config.CLASSIFICATION_BACKEND == "embedding" else "GPT-4 Mini"
+                p(f"→ Sending {len(unmatched)} products to {classifier} for classification "
+                  f"({len(classification_tasks)} chunks already sent while streaming)...")
+                flush_output()
+                matches, prompt_tokens, completion_tokens = await tax_matcher.match_categories(
+                    [line_items[i].get('description', '') for i in unmatched])
+                for i, match in zip(unmatched, matches):
+                    classifications[i] = match
+                total_prompt_tokens += prompt_tokens
+                total_completion_tokens += completion_tokens
+
+        # Amounts for every line item at once; missing totals fall back to quantity × unit price
+        count = len(line_items)
+        quantities = np.fromiter((float(item.get('quantity') or 0) for item in line_items),
+                                 dtype=np.float64, count=count)
+        unit_prices = np.fromiter((float(item.get('unit_price') or 0) for item in line_items),
+                                  dtype=np.float64, count=count)
+        extracted_totals = np.fromiter((np.nan if item.get('total') is None else float(item['total'])
+                                        for item in line_items), dtype=np.float64, count=count)
+        line_totals = np.where(np.isnan(extracted_totals), quantities * unit_prices, extracted_totals)
+        tax_rates = np.fromiter((tax_rate for _, tax_rate in classifications), dtype=np.float64, count=count)
+        tax_amounts = line_totals * tax_rates * 0.01
+
+        for idx, (item, (tax_category, tax_rate)) in enumerate(zip(line_items, classifications), 1):
             description = item.get('description', '')
-            quantity = float(item.get('quantity', 0))
-            unit_price = float(item.get('unit_price', 0))
-            line_total = float(item.get('total', quantity * unit_price))
-
-            print(f"\n{'-' * 80}")
-            print(f"LINE ITEM #{idx}")
-            print(f"{'-' * 80}")
-            print(f"Description: {description}")
-            print(f"Quantity: {quantity}")
-            print(f"Unit Price: ${unit_price:.2f}")
-            print(f"Line Total: ${line_total:.2f}")
-
-            # Classify with AI
-            print(f"\n→ Sending to GPT-4 Mini for classification...")
-            print(f"   Product: '{description}'")
-
-            tax_category, tax_rate = tax_matcher.match_category(description)
-
-            print(f"\n← GPT-4 Mini Response:")
-            print(f"   Tax Category: '{tax_category}'")
-            print(f"   Tax Rate: {tax_rate}%")
-
-            # Calculate tax
-            tax_amount = line_total * (tax_rate / 100)
-            line_total_with_tax = line_total + tax_amount
+            quantity = quantities[idx - 1]
+            unit_price = unit_prices[idx - 1]
+            line_total = line_totals[idx - 1]
 
-            print(f"\n   Calculation:")
-            print(f"   ${line_total:.2f} × {tax_rate}% = ${tax_amount:.2f} (tax)")
-            print(f"   ${line_total:.2f} + ${tax_amount:.2f} = ${line_total_with_tax:.2f} (total)")
+            tax_amount = tax_amounts[idx - 1]
+            line_total_with_tax = line_total + tax_amount
 
-            total_pre_tax += line_total
-            total_tax += tax_amount
+            p(ITEM_TEMPLATE.format(sep=SEP, idx=idx, desc=description, qty=quantity, unit=unit_price,
+                                   total=line_total, cat=tax_category, rate=tax_rate, tax=tax_amount,
+                                   grand=line_total_with_tax))
 
-        print("\n" + "=" * 80)
-        print("STEP 4: FINAL TOTALS")
-        print("=" * 80)
+        flush_output()
+        p("\n" + DBL)
+        p("STEP 4: FINAL TOTALS")
+        p(DBL)
 
+        total_pre_tax = float(line_totals.sum())
+        total_tax = float(tax_amounts.sum())
         total_post_tax = total_pre_tax + total_tax
         effective_rate = (total_tax / total_pre_tax * 100) if total_pre_tax > 0 else 0
 
-        print(f"\n  Pre-Tax Total:  ${total_pre_tax:>10.2f}")
-        print(f"  Tax Total:      ${total_tax:>10.2f}")
-        print(f"  Post-Tax Total: ${total_post_tax:>10.2f}")
-        print(f"\n  Effective Tax Rate: {effective_rate:.2f}%")
+        p(f"\n  Pre-Tax Total:  ${total_pre_tax:>10.2f}")
+        p(f"  Tax Total:      ${total_tax:>10.2f}")
+        p(f"  Post-Tax Total: ${total_post_tax:>10.2f}")
+        p(f"\n  Effective Tax Rate: {effective_rate:.2f}%")
+        p(f"  AI Tokens:      {total_prompt_tokens} prompt + {total_completion_tokens} completion")
 
-        print("\n" + "=" * 80)
-        print("TEST PASSED - ALL COMPONENTS WORKING CORRECTLY!")
-        print("=" * 80)
+        p("\n" + DBL)
+        p("TEST PASSED - ALL COMPONENTS WORKING CORRECTLY!")
+        p(DBL)
 
-        print("\n📊 Summary:")
-        print(f"  ✓ Extracted invoice with {len(line_items)} line items")
-        print(f"  ✓ Classified all items into tax categories")
-        print(f"  ✓ Calculated taxes accurately")
-        print(f"  ✓ Total invoice value: ${total_post_tax:.2f}")
+        p("\n📊 Summary:")
+        p(f"  ✓ Extracted invoice with {len(line_items)} line items")
+        p(f"  ✓ Classified all items into tax categories")
+        p(f"  ✓ Calculated taxes accurately")
+        p(f"  ✓ Total invoice value: ${total_post_tax:.2f}")
+        flush_output()
 
-        return True
+        return {
+            'line_items': len(line_items),
+            'pre_tax': total_pre_tax,
+            'tax': total_tax,
+            'post_tax': total_post_tax,
+            'prompt_tokens': total_prompt_tokens,
+            'completion_tokens': total_completion_tokens
+        }
 
     except Exception as e:
-        print(f"\n✗ TEST FAILED: {e}")
+        p(f"\n✗ TEST FAILED: {e}")
+        flush_output()
         import traceback
         traceback.print_exc()
-        return False
+        return None
+
+    finally:
+        extractor.clear_prefetched_pdf_content()
+        render_pool.shutdown()
+
+
+# Per worker process: one event loop and one client, reused for every PDF the worker handles
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _init_client(workers: int, log_level: int):
+    """
+    Set up a worker process of the multi-PDF runner.
+
+    The rate-limit budget is split evenly between the workers, since each
+    process paces its own calls. Probing is turned off because it would
+    hand every worker the account's whole budget.
+
+    Args:
+        workers: Number of worker processes sharing the rate limits
+        log_level: Level of the report logger (debug includes the raw extraction dump)
+    """
+    global _worker_loop
+
+    logger.setLevel(log_level)
+    Config.MODEL_RATE_LIMITS = {
+        model: (max(1, requests_per_minute // workers), max(1, tokens_per_minute // workers))
+        for model, (requests_per_minute, tokens_per_minute) in Config.MODEL_RATE_LIMITS.items()
+    }
+    Config.MAX_REQUESTS_PER_MINUTE = max(1, Config.MAX_REQUESTS_PER_MINUTE // workers)
+    Config.MAX_TOKENS_PER_MINUTE = max(1, Config.MAX_TOKENS_PER_MINUTE // workers)
+    Config.MAX_IN_FLIGHT_REQUESTS = max(1, Config.MAX_IN_FLIGHT_REQUESTS // workers)
+    Config.PROBE_RATE_LIMITS = False
+
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    _worker_loop.run_until_complete(warm_up(get_client()))
+
+
+def process_one_pdf(pdf_path: str) -> Dict[str, Any]:
+    """
+    Run the detailed test for one PDF inside a worker process.
+
+    Args:
+        pdf_path: Invoice PDF to process
+
+    Returns:
+        The test summary plus 'file', 'passed' and 'report' (the captured output)
+    """
+    report = io.StringIO()
+    with redirect_stdout(report):
+        summary = _worker_loop.run_until_complete(test_detailed(get_client(), pdf_path))
+    return {'file': pdf_path, 'passed': summary is not None, 'report': report.getvalue(), **(summary or {})}
+
+
+async def run_batched(pdf_paths: List[str]) -> List[Dict[str, Any]]:
+    """
+    Run the detailed test for several PDFs through one set of batch jobs.
+
+    All PDFs go into the same extraction and classification batches, since
+    every batch job can take hours regardless of its size; the reports are
+    then printed one invoice at a time.
+
+    Args:
+        pdf_paths: Invoice PDFs to process
+
+    Returns:
+        The test summary of each PDF plus 'file' and 'passed'
+    """
+    async with client_session() as client:
+        tax_matcher = TaxMatcher(client=client)
+        extractor = InvoiceExtractor(
+            categories=tax_matcher.categories if Config.FUSED_CLASSIFICATION else None,
+            client=client
+        )
+        p(f"\nSubmitting {len(pdf_paths)} PDFs to the OpenAI Batch API...")
+        p("(This can take up to 24 hours...)")
+        flush_output()
+        batch_results = await run_batch(pdf_paths, extractor, tax_matcher)
+
+        results = []
+        for pdf_path in pdf_paths:
+            summary = await test_detailed(client, pdf_path, batch_result=batch_results[pdf_path])
+            results.append({'file': pdf_path, 'passed': summary is not None, **(summary or {})})
+        return results
+
+
+def run(pdf_paths: List[str]) -> bool:
+    """
+    Run the detailed test for several PDFs in parallel worker processes.
+
+    Each report is printed whole as soon as its invoice finishes, followed
+    by one line per invoice and the overall totals. In batch mode the PDFs
+    share one set of batch jobs submitted from this process instead.
+
+    Args:
+        pdf_paths: Invoice PDFs to process
+
+    Returns:
+        True if every invoice passed
+    """
+    if Config.USE_BATCH_API:
+        results = asyncio.run(run_batched(pdf_paths))
+        processed_by = "one set of batch jobs"
+    else:
+        workers = min(len(pdf_paths), os.cpu_count() or 1)
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_client,
+                                 initargs=(workers, logger.level)) as executor:
+            futures = [executor.submit(process_one_pdf, pdf_path) for pdf_path in pdf_paths]
+            for future in as_completed(futures):
+                result = future.result()
+                sys.stdout.write(result['report'])
+                sys.stdout.flush()
+                results.append(result)
+        processed_by = f"{workers} workers"
+
+    p("\n" + DBL)
+    p(f"ALL INVOICES ({len(results)} processed with {processed_by})")
+    p(DBL)
+    for result in sorted(results, key=lambda r: r['file']):
+        if result['passed']:
+            p(f"  ✓ {result['file']}: {result['line_items']} line items, ${result['post_tax']:.2f} post-tax")
+        else:
+            p(f"  ✗ {result['file']}: FAILED")
+    passed = [result for result in results if result['passed']]
+    p(f"\n  Post-Tax Total: ${sum(result['post_tax'] for result in passed):.2f}")
+    p(f"  AI Tokens:      {sum(result['prompt_tokens'] for result in passed)} prompt + "
+      f"{sum(result['completion_tokens'] for result in passed)} completion")
+    flush_output()
+
+    return len(passed) == len(results)
 
 
 if __name__ == "__main__":
-    success = test_detailed()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Detailed invoice processing test')
+    parser.add_argument('pdfs', nargs='*', default=[DEFAULT_TEST_FILE],
+                        help='Invoice PDFs to process; several run in parallel worker processes')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Also show the raw extracted data returned by the model')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if len(args.pdfs) > 1:
+        sys.exit(0 if run(args.pdfs) else 1)
+
+    async def run_single():
+        # One client (and warmed-up connection) for every call in the test
+        async with client_session() as client:
+            return await test_detailed(client, args.pdfs[0])
+
+    success = asyncio.run(run_single()) is not None
+    sys.exit(0 if success else 1)